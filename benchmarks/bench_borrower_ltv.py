@@ -0,0 +1,123 @@
+# Benchmark: columnar Method 2 (borrower-level LTV with fallback) vs the previous per-loan loop
+import argparse
+import os
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ltv_tool_final_v4_fallback_and_ordering import calculate_borrower_based_ltv_with_fallback
+from synthetic_tape import DEBT_COL, make_clean_portfolio
+
+
+def legacy_borrower_based_ltv_with_fallback(df_loans, df_collateral):
+    """Per-loan loop of the original v4 tool, kept as the reference result.
+
+    Two changes only: the input is not mutated, and the Lien 1 merge leaves out the loans'
+    'Borrower reference' (the original merged it in twice and raised a KeyError on the
+    suffixed columns).
+    """
+    df_collateral = df_collateral.copy()
+    loan_order = {loan_ref: idx for idx, loan_ref in enumerate(df_loans['Loan reference'])}
+    loan_to_borrower = df_loans.set_index('Loan reference')['Borrower reference'].to_dict()
+    df_collateral['Borrower reference'] = df_collateral['Loan reference'].map(loan_to_borrower)
+
+    df_lien1 = df_collateral[df_collateral['Priority Ranking'] == 'Lien 1'].copy()
+
+    df_lien1_merged = pd.merge(df_lien1, df_loans.drop(columns='Borrower reference'), on='Loan reference', how='left')
+    fallback_lien1 = df_lien1_merged[['Loan reference', 'Borrower reference', 'Gross Appraisal Value', DEBT_COL]]
+    fallback_lien1 = fallback_lien1.groupby('Loan reference').agg({
+        'Borrower reference': 'first',
+        'Gross Appraisal Value': 'sum',
+        DEBT_COL: 'sum'
+    }).reset_index()
+    fallback_lien1['Conservative LTV (%)'] = fallback_lien1[DEBT_COL] / fallback_lien1['Gross Appraisal Value'] * 100
+
+    fallback_base = pd.merge(fallback_lien1, df_collateral[['Loan reference', 'Province', 'Collateral type']].drop_duplicates(), on='Loan reference', how='left')
+    fallback_ref = fallback_base.groupby(['Province', 'Collateral type']).apply(
+        lambda g: (g['Conservative LTV (%)'] * g[DEBT_COL]).sum() /
+                  g[DEBT_COL].sum()
+    ).reset_index(name='Weighted Avg Lien1 LTV')
+
+    borrower_records = []
+    for _, row in df_loans.iterrows():
+        loan = row['Loan reference']
+        borrower = row['Borrower reference']
+        loan_debt = row[DEBT_COL]
+
+        asset_rows = df_collateral[df_collateral['Loan reference'] == loan]
+        lien1_assets = asset_rows[asset_rows['Priority Ranking'] == 'Lien 1']
+        gt1_assets = asset_rows[asset_rows['Priority Ranking'] != 'Lien 1']
+
+        lien1_av = lien1_assets['Gross Appraisal Value'].sum()
+        gt1_av = gt1_assets['Gross Appraisal Value'].sum()
+
+        estimated_lien1_debt = 0
+        fallback_used = False
+        for _, asset_row in gt1_assets.iterrows():
+            province = asset_row['Province']
+            ctype = asset_row['Collateral type']
+            gross_av = asset_row['Gross Appraisal Value']
+            fallback_row = fallback_ref[(fallback_ref['Province'] == province) & (fallback_ref['Collateral type'] == ctype)]
+            if not fallback_row.empty:
+                fallback_ltv = fallback_row['Weighted Avg Lien1 LTV'].values[0] / 100
+                estimated_lien1_debt += fallback_ltv * gross_av
+                fallback_used = True
+
+        total_av = lien1_av + gt1_av
+        total_lien1_debt = estimated_lien1_debt if lien1_av == 0 else loan_debt if gt1_av == 0 else estimated_lien1_debt
+        adjusted_av_gt1 = gt1_av - total_lien1_debt if gt1_av > total_lien1_debt else 0
+        ltv_total = (loan_debt / total_av * 100) if total_av else 0
+        ltv_lien_gt1 = (loan_debt / adjusted_av_gt1 * 100) if adjusted_av_gt1 else 0
+
+        borrower_records.append({
+            'Loan reference': loan,
+            'Borrower reference': borrower,
+            DEBT_COL: loan_debt,
+            'Lien 1 Appraisal Value': lien1_av,
+            'Lien > 1 Appraisal Value': gt1_av,
+            'Estimated Lien 1 Debt': total_lien1_debt,
+            'Adjusted Lien > 1 Value': adjusted_av_gt1,
+            'Total LTV (%)': ltv_total,
+            'Lien > 1 LTV (%)': ltv_lien_gt1,
+            'Used Fallback': fallback_used
+        })
+
+    df_result = pd.DataFrame(borrower_records)
+    df_result['original_order'] = df_result['Loan reference'].map(loan_order)
+    return df_result.sort_values('original_order').drop(columns='original_order')
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Method 2 columnar vs legacy benchmark')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000],
+                        help='collateral row counts to benchmark')
+    parser.add_argument('--legacy-max-rows', type=int, default=10_000,
+                        help='largest tape the quadratic legacy loop is run on')
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} {'loans':>9} {'columnar (s)':>13} {'legacy (s)':>11} {'speed-up':>9}")
+    for size in args.sizes:
+        df_loans, df_collateral = make_clean_portfolio(size, lien_mix=(0.6, 0.3, 0.1), seed=size)
+        result, columnar_time = timed(calculate_borrower_based_ltv_with_fallback, df_loans, df_collateral)
+
+        legacy_cell, speedup_cell = '-', '-'
+        if size <= args.legacy_max_rows:
+            expected, legacy_time = timed(legacy_borrower_based_ltv_with_fallback, df_loans, df_collateral)
+            # The curve's 'Adjustment Factor (x)' column is new, so only the original columns are compared
+            pd.testing.assert_frame_equal(result[expected.columns].reset_index(drop=True),
+                                          expected.reset_index(drop=True), check_dtype=False)
+            legacy_cell, speedup_cell = f'{legacy_time:.2f}', f'{legacy_time / columnar_time:.0f}x'
+        print(f'{len(df_collateral):>10} {len(df_loans):>9} {columnar_time:>13.3f} {legacy_cell:>11} {speedup_cell:>9}')
+
+
+if __name__ == '__main__':
+    main()
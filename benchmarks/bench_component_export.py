@@ -0,0 +1,48 @@
+# Benchmark: component method export - per-loan expanded view vs component + link tables
+#
+#   python benchmarks/bench_component_export.py --loans 5000 --cross-collateral-rate 0.4
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ltv_portfolio import prepare_portfolio
+from ltv_export import write_result
+from ltv_tool_final_v4_fallback_and_ordering import calculate_comp_based_ltv_expanded, calculate_comp_based_ltv_tables
+from synthetic_tape import make_clean_portfolio
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Component method: expanded vs normalised export')
+    parser.add_argument('--loans', type=int, default=5000)
+    parser.add_argument('--cross-collateral-rate', type=float, default=0.4,
+                        help='share of links reusing an already pledged asset (higher = bigger clusters)')
+    args = parser.parse_args()
+
+    df_loans, df_collateral = make_clean_portfolio(args.loans * 2, cross_collateral_rate=args.cross_collateral_rate)
+    prepared = prepare_portfolio(df_loans, df_collateral)
+    sizes = prepared.loan_labels.value_counts()
+    print(f"{len(df_loans)} loans, {len(sizes)} components, largest {sizes.max()} loans")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        runs = {
+            'expanded': (calculate_comp_based_ltv_expanded, write_result),
+            'tables': (calculate_comp_based_ltv_tables, write_result),
+        }
+        print(f"{'view':>9} {'calc (s)':>9} {'export (s)':>11} {'file (MB)':>10}")
+        for name, (calculate, export) in runs.items():
+            start = time.perf_counter()
+            result = calculate(df_loans, df_collateral, prepared)
+            calc_seconds = time.perf_counter() - start
+            path = os.path.join(tmp_dir, f'{name}.xlsx')
+            start = time.perf_counter()
+            export(result, path)
+            export_seconds = time.perf_counter() - start
+            print(f"{name:>9} {calc_seconds:>9.2f} {export_seconds:>11.2f} {os.path.getsize(path) / 1e6:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
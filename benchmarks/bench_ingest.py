@@ -0,0 +1,83 @@
+# Benchmark: time and peak memory of the datatape load paths on a real or synthetic workbook
+#
+#   python benchmarks/bench_ingest.py path/to/tape.xlsx
+#
+# Each path runs in a fresh process so the peak resident set size is its own.
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ltv_ingest import read_datatape_columns, stream_datatape_columns
+from synthetic_tape import DEBT_COL
+
+LOAN_COLUMNS = ['Loan reference', DEBT_COL, 'Borrower reference']
+COLLATERAL_COLUMNS = ['Loan reference', 'Collateral unit reference', 'Plot',
+                      'Gross Appraisal Value', 'Priority Ranking', 'Collateral type', 'Province']
+
+
+def legacy_load(filepath):
+    """Whole-sheet read_excel followed by header promotion and subsetting, as the loaders did."""
+    rows_to_drop = list(range(0, 4)) + [5, 6]
+    frames = []
+    for sheet_name, columns in [('2.-Loan', LOAN_COLUMNS), ('4.-Loan & Collateral', COLLATERAL_COLUMNS)]:
+        df = pd.read_excel(filepath, sheet_name=sheet_name, header=None)
+        df = df.drop(index=rows_to_drop).reset_index(drop=True)
+        df.columns = df.iloc[0]
+        frames.append(df.drop(index=0).reset_index(drop=True)[columns])
+    return frames
+
+
+def streaming_load(filepath):
+    return [stream_datatape_columns(filepath, '2.-Loan', LOAN_COLUMNS, [DEBT_COL]),
+            stream_datatape_columns(filepath, '4.-Loan & Collateral', COLLATERAL_COLUMNS, ['Gross Appraisal Value'],
+                                    {'Gross Appraisal Value': 'n.a.'})]
+
+
+def cached_load(filepath, cache_dir):
+    return [read_datatape_columns(filepath, '2.-Loan', LOAN_COLUMNS, [DEBT_COL], cache_dir=cache_dir),
+            read_datatape_columns(filepath, '4.-Loan & Collateral', COLLATERAL_COLUMNS, ['Gross Appraisal Value'],
+                                  {'Gross Appraisal Value': 'n.a.'}, cache_dir=cache_dir)]
+
+
+def run_one(path_name, filepath, cache_dir):
+    load = {'imports only': lambda f: [None, []], 'legacy': legacy_load, 'streaming': streaming_load,
+            'cached': lambda f: cached_load(f, cache_dir)}[path_name]
+    start = time.perf_counter()
+    frames = load(filepath)
+    elapsed = time.perf_counter() - start
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f'{elapsed:.3f} {peak_mb:.1f} {len(frames[1])}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Datatape load paths: time and peak memory')
+    parser.add_argument('workbook')
+    parser.add_argument('--run-one', help=argparse.SUPPRESS)
+    parser.add_argument('--cache-dir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        run_one(args.run_one, args.workbook, args.cache_dir)
+        return
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        # Fill the cache first so the 'cached' row measures a warm read
+        cached_load(args.workbook, cache_dir)
+        print(f"{'path':>12} {'rows':>9} {'time (s)':>9} {'peak RSS (MB)':>14}")
+        for path_name in ['imports only', 'legacy', 'streaming', 'cached']:
+            out = subprocess.run([sys.executable, __file__, args.workbook, '--run-one', path_name, '--cache-dir', cache_dir],
+                                 capture_output=True, text=True, check=True).stdout.split()
+            elapsed, peak_mb, rows = out[-3:]
+            print(f'{path_name:>12} {rows:>9} {float(elapsed):>9.2f} {float(peak_mb):>14.0f}')
+
+
+if __name__ == '__main__':
+    main()
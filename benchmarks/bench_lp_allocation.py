@@ -0,0 +1,92 @@
+# Benchmark: sparse per-link allocation LP vs the previous dense loan x asset formulation
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+from pulp import PULP_CBC_CMD, LpProblem, LpVariable, LpMaximize, lpSum, value
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ltv_lp import build_allocation_lp
+
+
+def legacy_allocation_lp(loans_lien1, loans_lien_gt1, collaterals_component):
+    """Dense model as it stood before the sparse rewrite, kept for comparison only."""
+    prob = LpProblem("Collateral_Allocation_Component", LpMaximize)
+    x_L1 = LpVariable.dicts("x_L1", ((i, j) for i in loans_lien1 for j in collaterals_component), lowBound=0)
+    x_Lgt1 = LpVariable.dicts("x_Lgt1", ((i, j) for i in loans_lien_gt1 for j in collaterals_component), lowBound=0)
+    Z = LpVariable("Z", lowBound=0)
+
+    for i in loans_lien1:
+        prob += lpSum([x_L1[(i, j)] for j in collaterals_component]) >= loans_lien1[i] * Z
+    for i in loans_lien_gt1:
+        prob += lpSum([x_Lgt1[(i, j)] for j in collaterals_component]) >= loans_lien_gt1[i] * Z
+        for j in collaterals_component:
+            prob += x_Lgt1[(i, j)] <= collaterals_component[j] - lpSum([x_L1[(l, j)] for l in loans_lien1])
+    for j in collaterals_component:
+        prob += lpSum([x_L1[(i, j)] for i in loans_lien1]) + lpSum([x_Lgt1[(i, j)] for i in loans_lien_gt1]) == collaterals_component[j]
+
+    prob += Z
+    return prob, x_L1, x_Lgt1, Z
+
+
+def make_component(n_loans, assets_per_loan=2, lien1_share=0.6, seed=0):
+    """A single connected component: loan k is pledged on asset k plus random others."""
+    rng = np.random.default_rng(seed)
+    n_assets = n_loans
+    links = []
+    for k in range(n_loans):
+        others = rng.choice(n_assets, assets_per_loan, replace=False)
+        links += [(f"L{k}", f"A{a}") for a in {k, (k + 1) % n_assets, *others}]
+    debts = rng.uniform(1e5, 5e5, n_loans).round(2)
+    is_lien1 = rng.random(n_loans) < lien1_share
+    loans_lien1 = {f"L{k}": debts[k] for k in range(n_loans) if is_lien1[k]}
+    loans_lien_gt1 = {f"L{k}": debts[k] for k in range(n_loans) if not is_lien1[k]}
+    collaterals = {f"A{a}": v for a, v in enumerate(rng.uniform(2e5, 9e5, n_assets).round(2))}
+    return loans_lien1, loans_lien_gt1, collaterals, links
+
+
+def timed_build_and_solve(build, *args):
+    start = time.perf_counter()
+    prob, _, _, Z = build(*args)
+    build_time = time.perf_counter() - start
+    start = time.perf_counter()
+    prob.solve(PULP_CBC_CMD(msg=False))
+    return build_time, time.perf_counter() - start, value(Z), len(prob.variables()), len(prob.constraints)
+
+
+def check_small_cases():
+    """On complete components (every loan pledged on every asset) both models must agree on Z."""
+    for seed in range(5):
+        loans_lien1, loans_lien_gt1, collaterals, _ = make_component(4, seed=seed)
+        complete = [(i, j) for i in list(loans_lien1) + list(loans_lien_gt1) for j in collaterals]
+        _, _, z_sparse, _, _ = timed_build_and_solve(build_allocation_lp, loans_lien1, loans_lien_gt1, collaterals, complete)
+        _, _, z_dense, _, _ = timed_build_and_solve(legacy_allocation_lp, loans_lien1, loans_lien_gt1, collaterals)
+        assert abs(z_sparse - z_dense) <= 1e-9 * max(1.0, abs(z_dense)), (seed, z_sparse, z_dense)
+    print("Small complete components: sparse and dense optimal Z agree")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sparse vs dense allocation LP benchmark')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 25, 50, 100, 200],
+                        help='loans per component')
+    parser.add_argument('--legacy-max-loans', type=int, default=100,
+                        help='largest component the dense model is built for')
+    args = parser.parse_args()
+
+    check_small_cases()
+    print(f"{'loans':>6} {'model':>7} {'vars':>8} {'cons':>8} {'build (s)':>10} {'solve (s)':>10} {'Z':>10}")
+    for size in args.sizes:
+        loans_lien1, loans_lien_gt1, collaterals, links = make_component(size, seed=size)
+        runs = [('sparse', build_allocation_lp, (loans_lien1, loans_lien_gt1, collaterals, links))]
+        if size <= args.legacy_max_loans:
+            runs.append(('dense', legacy_allocation_lp, (loans_lien1, loans_lien_gt1, collaterals)))
+        for name, build, build_args in runs:
+            build_time, solve_time, z, n_vars, n_cons = timed_build_and_solve(build, *build_args)
+            print(f'{size:>6} {name:>7} {n_vars:>8} {n_cons:>8} {build_time:>10.3f} {solve_time:>10.3f} {z:>10.4f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+# Benchmark: per-component cost of the LP backends - PuLP/CBC, HiGHS one call per component, HiGHS batched
+#
+#   python benchmarks/bench_lp_backends.py --components 200 --sizes 2 6 20
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+from pulp import PULP_CBC_CMD
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_lp_allocation import make_component
+from ltv_lp import lp_allocation_batch
+
+
+def timed(problems, solver, backend, batched):
+    start = time.perf_counter()
+    if batched:
+        solved = lp_allocation_batch(problems, solver, backend)
+    else:
+        solved = [lp_allocation_batch([problem], solver, backend)[0] for problem in problems]
+    return time.perf_counter() - start, np.array([np.nan if Z is None else Z for _, Z, _, _ in solved])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Allocation LP backends: per-component overhead by component size')
+    parser.add_argument('--components', type=int, default=100, help='components per size')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[2, 6, 20], help='loans per component')
+    args = parser.parse_args()
+
+    solver = PULP_CBC_CMD(msg=False)
+    runs = [('pulp', 'pulp', False), ('highs', 'highs', False), ('highs batched', 'highs', True)]
+    print(f"{'loans':>6} {'backend':>14} {'ms/component':>13} {'speed-up':>9}")
+    for n_loans in args.sizes:
+        problems = []
+        for seed in range(args.components):
+            loans_lien1, loans_lien_gt1, collaterals, links = make_component(n_loans, seed=seed)
+            problems.append({"Loans_Lien1": loans_lien1, "Loans_LienGT1": loans_lien_gt1,
+                             "Collaterals": collaterals, "Links": links})
+
+        timings, reference = {}, None
+        for name, backend, batched in runs:
+            timings[name], Z = timed(problems, solver, backend, batched)
+            reference = Z if reference is None else reference
+            assert np.allclose(Z, reference, rtol=1e-6, equal_nan=True), name
+        for name, seconds in timings.items():
+            print(f"{n_loans:>6} {name:>14} {1000 * seconds / args.components:>13.2f} "
+                  f"{timings['pulp'] / seconds:>8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
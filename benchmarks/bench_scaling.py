@@ -0,0 +1,125 @@
+# Benchmark: how every LTV method scales with tape size, recorded for comparison across commits
+#
+#   python benchmarks/bench_scaling.py --tiers 1000 10000 50000 --methods loan borrower component lp
+#
+# Each tier is written as a synthetic datatape workbook; each method then runs on it in a fresh
+# process (load, prepare, compute) so its peak RSS is its own. The tape is read once beforehand,
+# so method loads are warm ingest-cache reads and the cold parse is reported as cold_load_s.
+# One JSON line per tier and method is appended to the results file together with the tape's
+# component-size statistics.
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ltv_batch import DEFAULT_METHODS, METHODS
+from ltv_components import label_components
+from ltv_portfolio import prepare_portfolio
+from ltv_tool_final_v4_fallback_and_ordering import load_clean_data
+from synthetic_tape import clean_synthetic_tape, make_synthetic_tape, write_synthetic_workbook
+
+RESULTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results', 'scaling.jsonl')
+
+
+def component_stats(df_collateral):
+    """Count and size distribution (loans + assets) of the collateral graph's components."""
+    _, loan_labels, asset_labels = label_components(df_collateral['Loan reference'], df_collateral['Asset ID'])
+    sizes = np.bincount(np.concatenate([loan_labels.to_numpy(), asset_labels.to_numpy()]))
+    if not len(sizes):
+        return {'components': 0}
+    return {'components': len(sizes), 'links': len(df_collateral), 'mean_size': float(sizes.mean()),
+            'p50_size': float(np.percentile(sizes, 50)), 'p99_size': float(np.percentile(sizes, 99)),
+            'max_size': int(sizes.max()), 'single_link': int((sizes == 2).sum())}
+
+
+def run_one(method, workbook):
+    """Load, prepare and run one method as ltv_batch does; print its timings as JSON."""
+    calculate, _ = METHODS[method]
+    timings = {}
+    start = time.perf_counter()
+    df_loans, df_collateral = load_clean_data(workbook)
+    timings['load_s'] = time.perf_counter() - start
+    start = time.perf_counter()
+    if method == 'lp':
+        args = (df_loans, df_collateral)
+    else:
+        args = (df_loans, df_collateral, prepare_portfolio(df_loans, df_collateral))
+    timings['prepare_s'] = time.perf_counter() - start
+    start = time.perf_counter()
+    result = calculate(*args)
+    timings['compute_s'] = time.perf_counter() - start
+    timings['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    timings['result_rows'] = sum(map(len, result.values())) if isinstance(result, dict) else len(result)
+    print(json.dumps(timings))
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Scaling of the LTV methods over synthetic tape sizes')
+    parser.add_argument('--tiers', type=int, nargs='+', default=[1000, 5000, 20000], help='loans per tape')
+    parser.add_argument('--methods', nargs='+', choices=list(METHODS), default=DEFAULT_METHODS)
+    parser.add_argument('--assets-per-loan', type=float, default=2.0)
+    parser.add_argument('--cross-collateral-rate', type=float, default=0.2)
+    parser.add_argument('--lien-mix', type=float, nargs='+', default=[0.7, 0.2, 0.1],
+                        help='share of loans ranked Lien 1, Lien 2, ...')
+    parser.add_argument('--na-rate', type=float, default=0.02, help="share of 'n.a.' appraisal values")
+    parser.add_argument('--provinces', type=int, default=20)
+    parser.add_argument('--types', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=RESULTS_PATH, help='JSON Lines file the results are appended to')
+    parser.add_argument('--run-one', nargs=2, metavar=('METHOD', 'WORKBOOK'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        run_one(*args.run_one)
+        return
+
+    shape = {'assets_per_loan': args.assets_per_loan, 'cross_collateral_rate': args.cross_collateral_rate,
+             'lien_mix': args.lien_mix, 'na_rate': args.na_rate, 'n_provinces': args.provinces,
+             'n_types': args.types, 'seed': args.seed}
+    run = {'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'), 'commit': _commit(),
+           'python': platform.python_version(), 'pandas': pd.__version__, 'numpy': np.__version__}
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+
+    print(f"{'loans':>8} {'method':>10} {'load (s)':>9} {'prep (s)':>9} {'calc (s)':>9} {'peak RSS (MB)':>14}")
+    with tempfile.TemporaryDirectory() as tmp_dir, open(args.output, 'a') as results:
+        for n_loans in args.tiers:
+            df_loans, df_collateral = make_synthetic_tape(n_loans, **shape)
+            workbook = write_synthetic_workbook(os.path.join(tmp_dir, f'tape_{n_loans}.xlsx'), df_loans, df_collateral)
+            components = component_stats(clean_synthetic_tape(df_loans, df_collateral)[1])
+            start = time.perf_counter()
+            load_clean_data(workbook)
+            cold_load = time.perf_counter() - start
+
+            for method in args.methods:
+                out = subprocess.run([sys.executable, __file__, '--run-one', method, workbook],
+                                     capture_output=True, text=True, check=True).stdout
+                timings = json.loads(out.strip().splitlines()[-1])
+                record = {**run, 'loans': n_loans, 'method': method, 'cold_load_s': cold_load, **timings,
+                          'shape': shape, 'component_stats': components}
+                results.write(json.dumps(record) + '\n')
+                print(f"{n_loans:>8} {method:>10} {timings['load_s']:>9.2f} {timings['prepare_s']:>9.2f} "
+                      f"{timings['compute_s']:>9.2f} {timings['peak_rss_mb']:>14.0f}")
+    print(f"Results appended to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+# Synthetic loan / collateral tapes shaped like the '2.-Loan' and '4.-Loan & Collateral' sheets
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+
+DEBT_COL = 'Total outstanding debt as of 29.02.2024'
+LOAN_SHEET = '2.-Loan'
+COLLATERAL_SHEET = '4.-Loan & Collateral'
+
+
+def make_synthetic_tape(n_loans=1000, assets_per_loan=2.0, cross_collateral_rate=0.2,
+                        lien_mix=(0.7, 0.2, 0.1), na_rate=0.0, n_provinces=20, n_types=5, seed=0):
+    """Raw loan and collateral sheets (after header promotion) with tunable shape.
+
+    assets_per_loan is the mean number of collateral links per loan, cross_collateral_rate the
+    share of links that reuse an asset already pledged to another loan, lien_mix the share of
+    loans ranked Lien 1, Lien 2, Lien 3, ... and na_rate the share of 'n.a.' appraisal values.
+    """
+    rng = np.random.default_rng(seed)
+
+    links_per_loan = 1 + rng.poisson(max(assets_per_loan - 1, 0), n_loans)
+    link_loans = np.repeat(np.arange(n_loans), links_per_loan)
+    n_links = len(link_loans)
+
+    # Fresh assets for most links, the rest point back at already-pledged assets
+    n_assets = max(int(round(n_links * (1 - cross_collateral_rate))), 1)
+    link_assets = np.concatenate([rng.permutation(n_assets), rng.integers(0, n_assets, n_links - n_assets)])
+    link_assets = rng.permutation(link_assets)
+
+    lien_mix = np.asarray(lien_mix, dtype=float)
+    loan_ranks = rng.choice(np.arange(1, len(lien_mix) + 1), n_loans, p=lien_mix / lien_mix.sum())
+
+    asset_gav = np.round(rng.lognormal(12.0, 0.8, n_assets), 2)
+    asset_province = rng.integers(0, n_provinces, n_assets)
+    asset_type = rng.integers(0, n_types, n_assets)
+    first_asset = link_assets[np.r_[0, np.cumsum(links_per_loan)[:-1]]]
+    loan_debt = np.round(asset_gav[first_asset] * rng.uniform(0.3, 1.1, n_loans), 2)
+
+    loan_refs = np.char.add('L', np.arange(n_loans).astype(str))
+    df_loans = pd.DataFrame({
+        'Loan reference': loan_refs,
+        DEBT_COL: loan_debt,
+        'Borrower reference': np.char.add('B', (np.arange(n_loans) // 2).astype(str))
+    })
+
+    gav = asset_gav[link_assets].astype(object)
+    gav[rng.random(n_links) < na_rate] = 'n.a.'
+    df_collateral = pd.DataFrame({
+        'Loan reference': loan_refs[link_loans],
+        'Collateral unit reference': np.char.add('CU', (link_assets // 3).astype(str)),
+        'Plot': link_assets % 3,
+        'Gross Appraisal Value': gav,
+        'Priority Ranking': np.char.add('Lien ', loan_ranks[link_loans].astype(str)),
+        'Collateral type': np.char.add('Type ', asset_type[link_assets].astype(str)),
+        'Province': np.char.add('Province ', asset_province[link_assets].astype(str))
+    }).drop_duplicates(['Loan reference', 'Collateral unit reference', 'Plot'], ignore_index=True)
+
+    return df_loans, df_collateral
+
+
+def write_synthetic_workbook(path, df_loans, df_collateral):
+    """Write raw sheets as a datatape workbook: four banner rows, the header, two description rows, data."""
+    workbook = Workbook(write_only=True)
+    for sheet_name, df in [(LOAN_SHEET, df_loans), (COLLATERAL_SHEET, df_collateral)]:
+        sheet = workbook.create_sheet(sheet_name)
+        sheet.append([f'Synthetic datatape - {sheet_name}'])
+        for _ in range(3):
+            sheet.append([])
+        sheet.append(list(df.columns))
+        sheet.append([f'Description of {col}' for col in df.columns])
+        sheet.append(['' for _ in df.columns])
+        for row in df.itertuples(index=False):
+            sheet.append([v.item() if isinstance(v, np.generic) else v for v in row])
+    workbook.save(path)
+    return path
+
+
+def clean_synthetic_tape(df_loans, df_collateral):
+    """Same column handling as load_clean_data, applied to in-memory sheets."""
+    df_collateral = df_collateral[df_collateral['Gross Appraisal Value'] != 'n.a.'].copy()
+    df_collateral['Asset ID'] = df_collateral['Collateral unit reference'].astype(str) + '__' + df_collateral['Plot'].astype(str)
+    df_loans = df_loans.copy()
+    df_loans[DEBT_COL] = pd.to_numeric(df_loans[DEBT_COL], errors='coerce')
+    df_collateral['Gross Appraisal Value'] = pd.to_numeric(df_collateral['Gross Appraisal Value'], errors='coerce')
+    return df_loans, df_collateral
+
+
+def make_clean_portfolio(n_collateral_rows, assets_per_loan=2.0, **kwargs):
+    """Cleaned frames sized by collateral row count rather than loan count."""
+    n_loans = max(int(n_collateral_rows / assets_per_loan), 1)
+    return clean_synthetic_tape(*make_synthetic_tape(n_loans, assets_per_loan=assets_per_loan, **kwargs))
@@ -1,88 +1,152 @@
 
+import math
+from collections import defaultdict
+
 import pandas as pd
-from pulp import LpProblem, LpVariable, LpMinimize, lpSum, LpStatus, value
+from pulp import PULP_CBC_CMD, LpProblem, LpVariable, LpMinimize, lpSum, LpStatus, value
+
+from ltv_components import component_links, label_components
+from ltv_export import read_split_sheet, write_result
+from ltv_ingest import read_datatape_columns
 
 def load_clean_data(filepath):
     """Load and clean loan and collateral data"""
-    rows_to_drop = list(range(0, 4)) + [5, 6]
-
-    # Load loan and collateral data
-    df_loans = pd.read_excel(filepath, sheet_name='2.-Loan', header=None)
-    df_collateral = pd.read_excel(filepath, sheet_name='4.-Loan & Collateral', header=None)
-
-    # Drop unnecessary rows & reset index
-    df_loans = df_loans.drop(index=rows_to_drop).reset_index(drop=True)
-    df_collateral = df_collateral.drop(index=rows_to_drop).reset_index(drop=True)
-
-    # Assign column headers
-    df_loans.columns = df_loans.iloc[0]
-    df_loans = df_loans.drop(index=0).reset_index(drop=True)
-
-    df_collateral.columns = df_collateral.iloc[0]
-    df_collateral = df_collateral.drop(index=0).reset_index(drop=True)
-
-    # Select relevant columns
-    df_loans = df_loans[['Loan reference', 'Total outstanding debt as of 29.02.2024', 'Borrower reference']]
-    df_collateral = df_collateral[['Loan reference', 'Collateral unit reference', 'Plot',
-                                   'Gross Appraisal Value', 'Priority Ranking', 'Collateral type', 'Province']]
-
-    # Remove invalid Gross Appraisal Values
-    df_collateral = df_collateral[df_collateral['Gross Appraisal Value'] != 'n.a.']
+    # Load the relevant loan and collateral columns, dropping 'n.a.' appraisal values
+    df_loans = read_datatape_columns(filepath, '2.-Loan',
+                                     ['Loan reference', 'Total outstanding debt as of 29.02.2024', 'Borrower reference'],
+                                     numeric_columns=['Total outstanding debt as of 29.02.2024'])
+    df_collateral = read_datatape_columns(filepath, '4.-Loan & Collateral',
+                                          ['Loan reference', 'Collateral unit reference', 'Plot',
+                                           'Gross Appraisal Value', 'Priority Ranking', 'Collateral type', 'Province'],
+                                          numeric_columns=['Gross Appraisal Value'],
+                                          drop_values={'Gross Appraisal Value': 'n.a.'})
 
     # Assign Asset ID for unique collateral tracking
     df_collateral['Asset ID'] = df_collateral['Collateral unit reference'].astype(str) + '__' + df_collateral['Plot'].astype(str)
 
-    # Convert loan amounts & appraisal values to numeric for optimization
-    df_loans['Total outstanding debt as of 29.02.2024'] = pd.to_numeric(df_loans['Total outstanding debt as of 29.02.2024'], errors='coerce')
-    df_collateral['Gross Appraisal Value'] = pd.to_numeric(df_collateral['Gross Appraisal Value'], errors='coerce')
-
     # Separate collateral into Lien 1 and Lien >1 for proper allocation
     df_lien1 = df_collateral[df_collateral['Priority Ranking'] == 'Lien 1'].copy()
     df_lien_gt1 = df_collateral[df_collateral['Priority Ranking'] != 'Lien 1'].copy()
 
     return df_loans, df_collateral, df_lien1, df_lien_gt1
 
-def minimize_weighted_avg_LTV(df_loans, df_collateral, df_lien1, df_lien_gt1):
-    """Set up LP model to minimize weighted average LTV"""
-    loans = dict(zip(df_loans['Loan reference'], df_loans['Total outstanding debt as of 29.02.2024']))
-    collaterals = dict(zip(df_collateral['Asset ID'], df_collateral['Gross Appraisal Value']))
+def _component_weighted_LTV(loans, collaterals, links, lien1_links, warm_start, solver, tol, max_iter):
+    """Minimise sum D_i * LTV_i = sum D_i^2 / A_i for one component by tangent cuts"""
+    loan_links, asset_links = defaultdict(list), defaultdict(list)
+    for i, j in links:
+        loan_links[i].append((i, j))
+        asset_links[j].append((i, j))
+    asset_debt = {j: sum(loans[i] for i, _ in asset_links[j]) for j in collaterals}
 
-    # Lien classifications
-    collateral_lien1 = df_lien1.groupby('Loan reference')['Asset ID'].apply(list).to_dict()
-    collateral_lien_gt1 = df_lien_gt1.groupby('Loan reference')['Asset ID'].apply(list).to_dict()
+    # Single loan or single asset: the optimum gives each loan collateral pro rata to its debt
+    if len(loans) == 1 or len(collaterals) == 1:
+        allocation = {(i, j): collaterals[j] * loans[i] / asset_debt[j] for i, j in links}
+        return allocation, "Optimal", 0
 
-    # LP Problem Definition
     prob = LpProblem("Minimize_Weighted_Avg_LTV", LpMinimize)
 
-    # Decision variables
-    x = LpVariable.dicts("x", ((i, j) for i in loans for j in collaterals), lowBound=0)
-    Z = LpVariable.dicts("Z", loans, lowBound=0)
-
-    # Objective Function: Minimize weighted average LTV
-    prob += lpSum([loans[i] * Z[i] for i in loans]), "Minimize_Weighted_LTV"
+    # Decision variables: only real loan-asset links, plus t_i >= D_i * LTV_i
+    x = LpVariable.dicts("x", links, lowBound=0)
+    t = LpVariable.dicts("t", loans, lowBound=0)
+    allocated = {i: lpSum([x[link] for link in loan_links[i]]) for i in loans}
 
-    # Constraint 1: LTV Calculation
-    for i in loans:
-        prob += lpSum([x[(i, j)] for j in collaterals]) * Z[i] >= loans[i], f"LTV_Calc_{i}"
+    # Objective Function: Minimize debt-weighted LTV (divided by total debt afterwards)
+    prob += lpSum([t[i] for i in loans]), "Minimize_Weighted_LTV"
 
-    # Constraint 2: Full Collateral Allocation
+    # Constraint 1: Full Collateral Allocation
     for j in collaterals:
-        prob += lpSum([x[(i, j)] for i in loans]) == collaterals[j], f"Collateral_{j}_allocation"
-
-    # Constraint 3: Lien Priority (Lien 1 first, then Lien >1)
-    for i in collateral_lien_gt1:
-        for j in collateral_lien_gt1[i]:
-            prob += lpSum([x[(i, j)]]) <= collaterals[j] - lpSum([x[(l, j)] for l in collateral_lien1 if j in collateral_lien1.get(l, [])]), f"LienGT1_Constraint_{i}_{j}"
-
-    # Solve LP
-    prob.solve()
-
-    # Extract results
-    allocation = {i: {j: value(x[(i, j)]) for j in collaterals} for i in loans}
-    optimal_LTVs = {i: value(Z[i]) for i in loans}
-    weighted_avg_LTV = sum(loans[i] * optimal_LTVs[i] for i in loans) / sum(loans.values())
+        prob += lpSum([x[link] for link in asset_links[j]]) == collaterals[j], f"Collateral_{j}_allocation"
+
+    # Constraint 2: Lien Priority (Lien >1 only draws on what Lien 1 leaves), one residual per asset
+    lien1_residual = {j: collaterals[j] - lpSum([x[link] for link in asset_links[j] if link in lien1_links])
+                      for j in collaterals}
+    for i, j in links:
+        if (i, j) not in lien1_links:
+            prob += x[(i, j)] <= lien1_residual[j], f"LienGT1_Constraint_{i}_{j}"
+
+    # Constraint 3: tangent cuts of the convex D_i^2 / A_i, first at the pro rata split and the
+    # warm start. Cut points are floored at 0.1% of pro rata to keep the coefficients well scaled.
+    pro_rata = {i: sum(collaterals[j] * loans[i] / asset_debt[j] for _, j in loan_links[i]) for i in loans}
+    previous = {i: sum(warm_start.get(i, {}).get(j, 0) or 0 for _, j in loan_links[i]) for i in loans}
+    cut_points = [pro_rata] + ([previous] if any(previous.values()) else [])
+
+    status = "Not Solved"
+    for iteration in range(1, max_iter + 1):
+        for points in cut_points:
+            for i, a in points.items():
+                a = max(a, 1e-3 * pro_rata[i])
+                prob += t[i] >= 2 * loans[i] ** 2 / a - loans[i] ** 2 / a ** 2 * allocated[i]
+        prob.solve(solver)
+        status = LpStatus[prob.status]
+        if status != "Optimal":
+            break
+
+        # Stop once the cut model's bound meets the true objective at the current allocation
+        current = {i: value(allocated[i]) or 0 for i in loans}
+        lower = value(prob.objective)
+        upper = sum(loans[i] ** 2 / current[i] if current[i] > 0 else float("inf") for i in loans)
+        if math.isfinite(upper) and upper - lower <= tol * upper:
+            break
+        cut_points = [current]
+    else:
+        status = "Not Converged"
+
+    allocation = {(i, j): value(x[(i, j)]) for i, j in links}
+    return allocation, status, iteration
+
+
+def minimize_weighted_avg_LTV(df_loans, df_collateral, df_lien1, df_lien_gt1, warm_start=None,
+                              solver=None, tol=1e-6, max_iter=50):
+    """Minimize weighted average LTV per connected component, optionally warm-started
+
+    The LTV of loan i is D_i / A_i for allocated collateral A_i, so sum D_i * LTV_i is
+    convex but not linear in the allocation. Each component is solved as a sequence of LPs
+    whose constraints are tangent cuts of D_i^2 / A_i; warm_start (last month's allocation,
+    {loan: {asset: value}}) places the first cuts at the previous optimum.
+    """
+    warm_start = warm_start or {}
+    solver = solver or PULP_CBC_CMD(msg=False)
+    loans = dict(zip(df_loans['Loan reference'], df_loans['Total outstanding debt as of 29.02.2024']))
+    collaterals = dict(zip(df_collateral['Asset ID'], df_collateral['Gross Appraisal Value']))
 
-    return allocation, optimal_LTVs, weighted_avg_LTV, LpStatus[prob.status]
+    # Loans on the tape with a positive debt, and the valued assets actually pledged to them
+    df_links = df_collateral[(df_collateral['Loan reference'].map(loans) > 0) & (df_collateral['Gross Appraisal Value'] > 0)]
+    df_links = df_links.drop_duplicates(['Loan reference', 'Asset ID'])
+    lien1_links = set(zip(df_lien1['Loan reference'], df_lien1['Asset ID']))
+
+    link_labels, _, _ = label_components(df_links['Loan reference'], df_links['Asset ID'])
+    allocation, statuses, lp_count = {}, [], 0
+    for comp_links in component_links(link_labels, df_links['Loan reference'], df_links['Asset ID']):
+        comp_loans = {i: loans[i] for i, _ in comp_links}
+        comp_collaterals = {j: collaterals[j] for _, j in comp_links}
+        comp_allocation, status, iterations = _component_weighted_LTV(
+            comp_loans, comp_collaterals, comp_links, lien1_links & set(comp_links), warm_start, solver, tol, max_iter)
+        for (i, j), alloc in comp_allocation.items():
+            allocation.setdefault(i, {})[j] = alloc
+        statuses.append(status)
+        lp_count += iterations
+
+    print(f"Solved {len(statuses)} components with {lp_count} cutting-plane LPs")
+
+    # Extract results: loans without pledged collateral have no LTV
+    optimal_LTVs = {}
+    for i in loans:
+        total_allocated = sum(allocation.get(i, {}).values())
+        optimal_LTVs[i] = loans[i] / total_allocated if total_allocated > 0 else None
+    secured = [i for i in loans if optimal_LTVs[i] is not None]
+    secured_debt = sum(loans[i] for i in secured)
+    weighted_avg_LTV = sum(loans[i] * optimal_LTVs[i] for i in secured) / secured_debt if secured_debt else None
+    status = next((s for s in statuses if s != "Optimal"), "Optimal")
+
+    return allocation, optimal_LTVs, weighted_avg_LTV, status
+
+def load_previous_allocation(output_file):
+    """Read last run's 'Collateral Allocation' sheet back as a warm start"""
+    df_alloc = read_split_sheet(output_file, 'Collateral Allocation')
+    warm_start = {}
+    for loan, asset, alloc in zip(df_alloc['Loan'], df_alloc['Asset'], df_alloc['Allocated Collateral']):
+        warm_start.setdefault(loan, {})[asset] = alloc
+    return warm_start
 
 def save_results_to_excel(allocation, optimal_LTVs, weighted_avg_LTV, status, output_file="output.xlsx"):
     """Save results to an Excel file"""
@@ -100,11 +164,8 @@ def save_results_to_excel(allocation, optimal_LTVs, weighted_avg_LTV, status, ou
 
     df_summary = pd.DataFrame({'LP Solver Status': [status], 'Minimized Weighted Average LTV': [weighted_avg_LTV]})
 
-    # Save to Excel file
-    with pd.ExcelWriter(output_file) as writer:
-        df_alloc.to_excel(writer, sheet_name='Collateral Allocation', index=False)
-        df_LTVs.to_excel(writer, sheet_name='Optimized LTVs', index=False)
-        df_summary.to_excel(writer, sheet_name='Summary', index=False)
+    # Save to Excel file (streamed; a sheet past Excel's row limit continues in 'Name (2)', ...)
+    write_result({'Collateral Allocation': df_alloc, 'Optimized LTVs': df_LTVs, 'Summary': df_summary}, output_file)
 
     print(f"Results saved to {output_file}")
 
@@ -114,8 +175,13 @@ def main():
     # Load data
     df_loans, df_collateral, df_lien1, df_lien_gt1 = load_clean_data(filepath)
 
+    # Warm-start from last month's allocation when one is available
+    previous_file = None  # e.g. "output_previous_month.xlsx"
+    warm_start = load_previous_allocation(previous_file) if previous_file else None
+
     # Run LP optimization
-    allocation, optimal_LTVs, weighted_avg_LTV, status = minimize_weighted_avg_LTV(df_loans, df_collateral, df_lien1, df_lien_gt1)
+    allocation, optimal_LTVs, weighted_avg_LTV, status = minimize_weighted_avg_LTV(
+        df_loans, df_collateral, df_lien1, df_lien_gt1, warm_start=warm_start)
 
     # Save results to Excel
     save_results_to_excel(allocation, optimal_LTVs, weighted_avg_LTV, status)
@@ -0,0 +1,131 @@
+# Batch LTV runner: every requested method for many datatapes, no interactive prompts.
+#
+#   python ltv_batch.py tape_2024_01.xlsx tape_2024_02.xlsx --methods loan borrower component lp --workers 4
+#
+# Each tape is read once, prepared once and then run through the chosen methods; tapes are
+# processed concurrently in worker processes and per-stage timings are printed per tape.
+# With --profile each tape also gets <output-dir>/<tape name>/profile.json (see ltv_profile).
+# Outputs are written once every method has run, several at a time with --export-workers, as
+# xlsx, Parquet or CSV (--format; see ltv_export).
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from final_ltv_with_lp_method import calculate_lp_based_ltv
+from ltv_export import FORMATS, with_format, write_results
+from ltv_lp import LP_BACKENDS
+from ltv_portfolio import prepare_portfolio
+from ltv_profile import profiling, span
+from ltv_tool_final_v4_fallback_and_ordering import (calculate_borrower_based_ltv_with_fallback,
+                                                     calculate_comp_based_ltv_expanded, calculate_comp_based_ltv_tables,
+                                                     calculate_loan_level_ltv_with_fallback, calculate_waterfall_ltv,
+                                                     load_clean_data)
+
+# Method name -> (calculation, output file); output names match the interactive scripts
+METHODS = {
+    'loan': (calculate_loan_level_ltv_with_fallback, 'ltv_loan_level_full.xlsx'),
+    'borrower': (calculate_borrower_based_ltv_with_fallback, 'ltv_borrower_with_fallback.xlsx'),
+    'component': (calculate_comp_based_ltv_tables, 'ltv_component_based.xlsx'),
+    'component_expanded': (calculate_comp_based_ltv_expanded, 'ltv_component_expanded.xlsx'),
+    'waterfall': (calculate_waterfall_ltv, 'ltv_waterfall.xlsx'),
+    'lp': (calculate_lp_based_ltv, 'ltv_lp_allocation.xlsx'),
+}
+# The per-loan component view repeats every component's asset list, so it only runs when asked for
+DEFAULT_METHODS = [method for method in METHODS if method != 'component_expanded']
+
+
+def run_tape(filepath, methods, output_dir, lp_cache=None, lp_backend='pulp', profile=False, cprofile_stage=None,
+             export_format='xlsx', export_workers=None):
+    """Load, prepare and run one tape; returns (filepath, [(stage, seconds)], error)."""
+    timings = []
+
+    def timed(stage, func, *args):
+        start = time.perf_counter()
+        result = func(*args)
+        timings.append((stage, time.perf_counter() - start))
+        return result
+
+    tape_dir = os.path.join(output_dir, os.path.splitext(os.path.basename(filepath))[0])
+    try:
+        os.makedirs(tape_dir, exist_ok=True)
+        with profiling(os.path.join(tape_dir, 'profile.json') if profile else None, cprofile_stage):
+            outputs = _run_methods(filepath, methods, tape_dir, lp_cache, lp_backend, timed, export_format)
+            with span('export', outputs=len(outputs), format=export_format):
+                timed('export', write_results, outputs, export_workers)
+    except Exception as exc:  # one bad tape must not stop the nightly batch
+        return filepath, timings, f'{type(exc).__name__}: {exc}'
+    return filepath, timings, None
+
+
+def _run_methods(filepath, methods, tape_dir, lp_cache, lp_backend, timed, export_format):
+    """Run the methods on one tape; returns {output path: result} for write_results()."""
+    df_loans, df_collateral = timed('load', load_clean_data, filepath)
+    prepared = timed('prepare', prepare_portfolio, df_loans, df_collateral) if set(methods) - {'lp'} else None
+
+    outputs = {}
+    for method in methods:
+        calculate, output_file = METHODS[method]
+        # The LP method builds its own component problems from the cleaned frames
+        if method == 'lp':
+            calculate, args = partial(calculate, cache_path=lp_cache, backend=lp_backend), (df_loans, df_collateral)
+        else:
+            args = (df_loans, df_collateral, prepared)
+        outputs[with_format(os.path.join(tape_dir, output_file), export_format)] = timed(method, calculate, *args)
+    return outputs
+
+
+def _report(outcomes):
+    failures = 0
+    for filepath, timings, error in outcomes:
+        total = sum(seconds for _, seconds in timings)
+        print(f"{filepath}: {total:.2f}s total")
+        for stage, seconds in timings:
+            print(f"  {stage:<20} {seconds:8.2f}s")
+        if error:
+            failures += 1
+            print(f"  FAILED: {error}")
+    return failures
+
+
+def run_batch(filepaths, methods, output_dir='ltv_output', workers=None, lp_cache=None, lp_backend='pulp',
+              profile=False, cprofile_stage=None, export_format='xlsx', export_workers=None):
+    """Run every tape (concurrently when workers > 1), print its stage timings, return the failure count."""
+    run = partial(run_tape, methods=methods, output_dir=output_dir, lp_cache=lp_cache, lp_backend=lp_backend,
+                  profile=profile, cprofile_stage=cprofile_stage, export_format=export_format,
+                  export_workers=export_workers)
+    if not workers or workers <= 1:
+        return _report(map(run, filepaths))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return _report(executor.map(run, filepaths))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run LTV methods over many datatapes without prompts.")
+    parser.add_argument('tapes', nargs='+', help="Excel datatape workbooks")
+    parser.add_argument('--methods', nargs='+', choices=list(METHODS), default=DEFAULT_METHODS,
+                        help="methods to run on every tape (default: all but component_expanded)")
+    parser.add_argument('--output-dir', default='ltv_output', help="outputs go to <output-dir>/<tape name>/")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="tapes processed in parallel")
+    parser.add_argument('--lp-cache', help="SQLite file caching component LP solutions across tapes and runs")
+    parser.add_argument('--lp-backend', choices=list(LP_BACKENDS), default='pulp',
+                        help="LP backend for the lp method: pulp (CBC) or highs (in-process)")
+    parser.add_argument('--format', choices=FORMATS, default='xlsx', help="output format of every method")
+    parser.add_argument('--export-workers', type=int, default=1,
+                        help="method outputs of a tape written in parallel processes")
+    parser.add_argument('--profile', action='store_true',
+                        help="write per-stage time / memory / counts to <output-dir>/<tape name>/profile.json")
+    parser.add_argument('--cprofile-stage', help="also run this stage under cProfile (e.g. lp.solve, loan_level)")
+    args = parser.parse_args(argv)
+
+    failures = run_batch(args.tapes, args.methods, args.output_dir, args.workers, args.lp_cache, args.lp_backend,
+                         args.profile or bool(args.cprofile_stage), args.cprofile_stage, args.format,
+                         args.export_workers)
+    print(f"{len(args.tapes) - failures}/{len(args.tapes)} tapes completed")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,128 @@
+# Connected components of the loan–asset collateral graph on integer codes
+# (replaces building an nx.Graph edge by edge from iterrows()).
+import numpy as np
+import pandas as pd
+
+from ltv_fallback import apply_fallback, lien_rank, sum_by_key
+from ltv_profile import span
+
+try:
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+except ImportError:  # scipy is optional; fall back to the NumPy union-find below
+    connected_components = None
+
+
+def _union_find_labels(n_nodes, u, v):
+    """Component root for every node, by vectorised hooking + pointer jumping."""
+    parent = np.arange(n_nodes)
+    while True:
+        pu, pv = parent[u], parent[v]
+        if (pu == pv).all():
+            return parent
+        # Hook the larger root under the smaller one, then compress every path to its root
+        np.minimum.at(parent, np.maximum(pu, pv), np.minimum(pu, pv))
+        while True:
+            grandparent = parent[parent]
+            if (grandparent == parent).all():
+                break
+            parent = grandparent
+
+
+def label_components(loan_refs, asset_ids):
+    """Component label for each link, each loan and each asset of the collateral graph.
+
+    Components are numbered 0..k-1 in order of their first loan in loan_refs, so labels are
+    stable between runs. Returns (link_labels, loan_labels, asset_labels): an array aligned
+    with the input links and two Series indexed by Loan reference / Asset ID.
+    """
+    with span('components') as stage:
+        loan_codes, loans = pd.factorize(pd.Series(loan_refs), use_na_sentinel=False)
+        asset_codes, assets = pd.factorize(pd.Series(asset_ids), use_na_sentinel=False)
+        n_loans, n_nodes = len(loans), len(loans) + len(assets)
+        u, v = loan_codes, asset_codes + n_loans
+
+        if connected_components is not None:
+            graph = coo_matrix((np.ones(len(u), dtype=np.int8), (u, v)), shape=(n_nodes, n_nodes))
+            _, roots = connected_components(graph, directed=False)
+        else:
+            roots = _union_find_labels(n_nodes, u, v)
+
+        # Renumber by first node so both backends agree on the numbering
+        _, first_node, node_labels = np.unique(roots, return_index=True, return_inverse=True)
+        node_labels = np.argsort(np.argsort(first_node))[node_labels]
+        stage.count(links=len(u), components=len(first_node))
+
+    loan_labels = pd.Series(node_labels[:n_loans], index=pd.Index(loans, name='Loan reference'), name='Component')
+    asset_labels = pd.Series(node_labels[n_loans:], index=pd.Index(assets, name='Asset ID'), name='Component')
+    return node_labels[u], loan_labels, asset_labels
+
+
+def component_members(loan_labels, asset_labels):
+    """(loans, assets) lists for every component, in label order."""
+    n_components = int(max(loan_labels.max(), asset_labels.max())) + 1 if len(loan_labels) else 0
+    return list(zip(_split_by_label(loan_labels, n_components), _split_by_label(asset_labels, n_components)))
+
+
+def component_links(link_labels, loan_refs, asset_ids):
+    """Distinct (loan, asset) pairs for every component, in label order."""
+    n_components = int(link_labels.max()) + 1 if len(link_labels) else 0
+    pairs = pd.Series(link_labels, index=pd.MultiIndex.from_arrays([np.asarray(loan_refs), np.asarray(asset_ids)]))
+    pairs = pairs[~pairs.index.duplicated()]
+    return _split_by_label(pairs, n_components)
+
+
+def _split_by_label(labels, n_components):
+    order = np.argsort(labels.to_numpy(), kind='stable')
+    bounds = np.searchsorted(labels.to_numpy()[order], np.arange(1, n_components))
+    members = labels.index.to_numpy()[order]
+    return [list(part) for part in np.split(members, bounds)]
+
+
+def aggregate_components(df_links, link_labels, debt_col, gav_col, fallback_ref=None):
+    """Debt, gross AV and LTV metrics for every component in one grouped pass.
+
+    Gross AV is summed over distinct assets and debt over distinct loans of each lien class.
+    With a fallback table, Lien >1 links on assets without any Lien 1 loan add the fallback
+    estimate to the component's Lien 1 debt. Returns one row per component label.
+    """
+    components = pd.RangeIndex(int(link_labels.max()) + 1 if len(link_labels) else 0, name='Component')
+    links = df_links.assign(Component=link_labels)
+    # Parsed like the Lien Rank of prepare_portfolio, so every method classifies liens alike
+    is_lien1 = lien_rank(links['Priority Ranking']) == 1
+    lien1_links, gt1_links = links[is_lien1], links[~is_lien1]
+
+    def distinct_sum(frame, key, col):
+        return frame.drop_duplicates(['Component', key, col]).groupby('Component')[col].sum().reindex(components, fill_value=0)
+
+    total_gav = distinct_sum(links, 'Asset ID', gav_col)
+    total_lien1_debt = distinct_sum(lien1_links, 'Loan reference', debt_col)
+    total_lien_gt1_debt = distinct_sum(gt1_links, 'Loan reference', debt_col)
+    fallback_used = pd.Series(False, index=components)
+
+    if fallback_ref is not None:
+        uncovered = gt1_links[~gt1_links['Asset ID'].isin(lien1_links['Asset ID'])]
+        fallback = apply_fallback(uncovered, fallback_ref, gav_col)
+        total_lien1_debt = total_lien1_debt + sum_by_key(fallback['Fallback Lien 1 Debt'], uncovered['Component']).reindex(components, fill_value=0)
+        fallback_used = fallback['Fallback Matched'].groupby(uncovered['Component']).any().reindex(components, fill_value=False)
+
+    adjusted_av_gt1 = (total_gav - total_lien1_debt).where(total_gav > total_lien1_debt, 0)
+    return pd.DataFrame({
+        'Total Lien 1 Debt': total_lien1_debt,
+        'Total Lien > 1 Debt': total_lien_gt1_debt,
+        'Component Gross AV': total_gav,
+        'Lien 1 LTV %': (total_lien1_debt / total_gav * 100).where(total_gav != 0, 0),
+        'Lien > 1 LTV %': (total_lien_gt1_debt / adjusted_av_gt1 * 100).where(adjusted_av_gt1 != 0, 0),
+        'Component LTV (%)': ((total_lien1_debt + total_lien_gt1_debt) / total_gav * 100).where(total_gav != 0, 0),
+        'Used Fallback': fallback_used.astype(bool)
+    }, index=components)
+
+
+def join_members(labels):
+    """Comma-joined member list per component label, in member order."""
+    order = np.argsort(labels.to_numpy(), kind='stable')
+    sorted_labels = labels.to_numpy()[order]
+    members = labels.index.to_numpy(dtype=object)[order]
+    components, starts = np.unique(sorted_labels, return_index=True)
+    # str() per member: a missing ID (e.g. a blank Plot) is a float NaN, listed as 'nan'
+    return pd.Series([', '.join(map(str, part)) for part in np.split(members, starts[1:])], index=components)
@@ -0,0 +1,37 @@
+# LTV adjustment curves (S&P style): LTV (%) -> adjustment factor, applied to whole LTV columns
+import os
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+SPAIN_CURVE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Exact_Spain_LTV_Curve__S_P_Style_.csv')
+CURVE_LTV_COL = 'LTV (%)'
+CURVE_FACTOR_COL = 'Adjustment Factor (x)'
+
+
+def load_curve(path=SPAIN_CURVE_PATH, ltv_col=CURVE_LTV_COL, factor_col=CURVE_FACTOR_COL):
+    """(ltv, factor) float arrays of a curve CSV, sorted by LTV with duplicate LTVs dropped."""
+    df_curve = pd.read_csv(path)[[ltv_col, factor_col]].apply(pd.to_numeric, errors='coerce').dropna()
+    df_curve = df_curve.sort_values(ltv_col, kind='stable').drop_duplicates(ltv_col)
+    return df_curve[ltv_col].to_numpy(dtype=float), df_curve[factor_col].to_numpy(dtype=float)
+
+
+@lru_cache(maxsize=None)
+def spain_curve():
+    return load_curve()
+
+
+def curve_factor(ltv_pct, curve=None):
+    """Adjustment factor for every LTV (%) by linear interpolation on the curve.
+
+    LTVs below / above the curve take its first / last factor; missing LTVs stay NaN.
+    """
+    ltv_points, factors = curve if curve is not None else spain_curve()
+    return np.interp(np.asarray(ltv_pct, dtype=float), ltv_points, factors)
+
+
+def add_curve_factor(df, ltv_col, out_col=CURVE_FACTOR_COL, curve=None, scale=1):
+    """df with out_col = curve factor of df[ltv_col] * scale (scale=100 for LTVs held as ratios)."""
+    df[out_col] = curve_factor(df[ltv_col].to_numpy(dtype=float) * scale, curve)
+    return df
@@ -0,0 +1,164 @@
+# Result export: Parquet, CSV or xlsx from one call, several outputs written concurrently.
+#
+# A result is a DataFrame or a {sheet name: DataFrame} dict. xlsx is written row by row with
+# a constant-memory writer (xlsxwriter when installed, else openpyxl write-only mode) instead
+# of pandas' in-memory workbook, and a sheet longer than Excel's row limit carries on in
+# 'Name (2)', 'Name (3)', ... Parquet and CSV write one file per sheet ('<stem>.<sheet>.csv'
+# for dict results); CSV files are written by DataFrame.to_csv in pandas' usual format. The
+# format follows the output path's extension.
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+try:
+    import xlsxwriter
+except ImportError:  # xlsxwriter is optional; openpyxl's write-only mode streams as well
+    xlsxwriter = None
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is optional; only Parquet export needs it
+    pa = None
+
+EXCEL_MAX_ROWS = 1_048_576
+EXCEL_MAX_SHEET_NAME = 31
+FORMATS = ('xlsx', 'parquet', 'csv')
+DEFAULT_SHEET = 'Sheet1'
+INF_REP = 'inf'  # how infinite floats are written to xlsx, as DataFrame.to_excel(inf_rep='inf')
+
+
+def export_format(path):
+    fmt = os.path.splitext(path)[1].lstrip('.').lower()
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported export format '{fmt}' for {path}; expected one of {FORMATS}")
+    return fmt
+
+
+def with_format(path, fmt):
+    """path with its extension replaced by fmt ('xlsx', 'parquet' or 'csv')."""
+    return f'{os.path.splitext(path)[0]}.{fmt}'
+
+
+def sheet_part_name(sheet_name, part):
+    """Name of the part-th (0-based) sheet a long sheet is split into, within Excel's 31 characters."""
+    if part == 0:
+        return sheet_name[:EXCEL_MAX_SHEET_NAME]
+    suffix = f' ({part + 1})'
+    return sheet_name[:EXCEL_MAX_SHEET_NAME - len(suffix)] + suffix
+
+
+def _cell_columns(df):
+    """Columns as object arrays of plain Python values, missing values as None (empty cells).
+
+    Infinite floats become 'inf' / '-inf' strings, as pandas writes them; the write-only
+    workbooks would otherwise store them as empty numeric cells.
+    """
+    columns = []
+    for _, col in df.items():
+        values = col.astype(object).to_numpy(copy=True)
+        values[pd.isna(col).to_numpy()] = None
+        if col.dtype.kind == 'f':
+            data = col.to_numpy(dtype=float, na_value=np.nan)
+        elif col.dtype == object:
+            data = np.array([v if isinstance(v, float) else 0.0 for v in values], dtype=float)
+        else:
+            data = None
+        if data is not None:
+            values[data == np.inf] = INF_REP
+            values[data == -np.inf] = '-' + INF_REP
+        columns.append(values)
+    return columns
+
+
+def _write_xlsx(tables, path, max_rows=EXCEL_MAX_ROWS):
+    rows_per_sheet = max_rows - 1  # the header takes a row on every sheet
+    if xlsxwriter is not None:
+        workbook = xlsxwriter.Workbook(path, {'constant_memory': True, 'nan_inf_to_errors': True,
+                                              'default_date_format': 'yyyy-mm-dd'})
+        add_sheet = workbook.add_worksheet
+
+        def write_rows(sheet, rows):
+            for r, row in enumerate(rows):
+                sheet.write_row(r, 0, row)
+        close = workbook.close
+    else:
+        from openpyxl import Workbook
+        workbook = Workbook(write_only=True)
+        add_sheet = workbook.create_sheet
+
+        def write_rows(sheet, rows):
+            for row in rows:
+                sheet.append(row)
+
+        def close():
+            workbook.save(path)
+
+    for sheet_name, df in tables.items():
+        header = [str(col) for col in df.columns]
+        for part, start in enumerate(range(0, len(df), rows_per_sheet) or [0]):
+            block = df.iloc[start:start + rows_per_sheet]
+            rows = zip(*_cell_columns(block)) if len(block.columns) else ([] for _ in range(len(block)))
+            write_rows(add_sheet(sheet_part_name(sheet_name, part)), _with_header(header, rows))
+    close()
+
+
+def _with_header(header, rows):
+    yield header
+    for row in rows:
+        yield list(row)
+
+
+def _file_name(path, sheet_name, single):
+    if single:
+        return path
+    stem, ext = os.path.splitext(path)
+    return f"{stem}.{re.sub(r'[^A-Za-z0-9_-]+', '_', sheet_name)}{ext}"
+
+
+def write_result(result, path, max_rows=EXCEL_MAX_ROWS):
+    """Write a DataFrame or {sheet name: DataFrame} result to path in the format of its extension.
+
+    Returns the files written. max_rows is the xlsx sheet row limit, header included.
+    """
+    fmt = export_format(path)
+    tables = result if isinstance(result, dict) else {DEFAULT_SHEET: result}
+    if fmt == 'xlsx':
+        _write_xlsx(tables, path, max_rows)
+        return [path]
+
+    written = []
+    for sheet_name, df in tables.items():
+        file_path = _file_name(path, sheet_name, not isinstance(result, dict))
+        if fmt == 'parquet':
+            if pa is None:
+                raise ImportError("Parquet export needs pyarrow")
+            pq.write_table(pa.Table.from_pandas(df, preserve_index=False), file_path)
+        else:
+            # pandas' CSV format (minimal quoting, True/False, ISO timestamps) as before
+            df.to_csv(file_path, index=False)
+        written.append(file_path)
+    return written
+
+
+def _write_one(item):
+    path, result = item
+    return write_result(result, path)
+
+
+def write_results(outputs, workers=None):
+    """Write {path: result} outputs, in worker processes when workers > 1; returns the files written."""
+    if not workers or workers <= 1 or len(outputs) <= 1:
+        return [file_path for item in outputs.items() for file_path in _write_one(item)]
+    with ProcessPoolExecutor(max_workers=min(workers, len(outputs))) as executor:
+        return [file_path for files in executor.map(_write_one, outputs.items()) for file_path in files]
+
+
+def read_split_sheet(path, sheet_name):
+    """One sheet of an xlsx written by write_result(), with the parts of a split sheet joined back."""
+    sheets = pd.read_excel(path, sheet_name=None)
+    parts = [sheets[name] for name in (sheet_part_name(sheet_name, part) for part in range(len(sheets)))
+             if name in sheets]
+    return pd.concat(parts, ignore_index=True) if parts else sheets[sheet_name]
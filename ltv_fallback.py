@@ -0,0 +1,85 @@
+# Fallback Lien 1 LTV engine: weighted-average Lien 1 LTV per (Province, Collateral type),
+# applied to Lien >1 collateral rows in one columnar pass instead of a per-row table scan.
+import numpy as np
+import pandas as pd
+
+FALLBACK_KEYS = ['Province', 'Collateral type']
+FALLBACK_COL = 'Weighted Avg Lien1 LTV'
+
+
+def lien_rank(priority):
+    """'Lien 1' -> 1, 'Lien 2' -> 2, ...; anything else -> 0 (never Lien 1)."""
+    priority = priority.astype('category')
+    ranks = priority.cat.categories.to_series().astype(str).str.extract(r'^Lien ([1-9]\d*)$')[0]
+    ranks = pd.to_numeric(ranks, errors='coerce').fillna(0).astype(np.int8).to_numpy()
+    codes = priority.cat.codes.to_numpy()
+    return np.where(codes >= 0, ranks[codes], 0).astype(np.int8)
+
+
+def build_fallback_table(df_lien1_loans, df_links, ltv_col, weight_col):
+    """Weighted-average Lien 1 LTV (%) per (Province, Collateral type).
+
+    df_lien1_loans holds one row per Lien 1 loan with its LTV and weight; df_links
+    maps each loan to the provinces / collateral types it is secured on.
+    """
+    base = df_lien1_loans[['Loan reference', ltv_col, weight_col]].merge(
+        df_links[['Loan reference'] + FALLBACK_KEYS].drop_duplicates(), on='Loan reference', how='left')
+    base['_weighted'] = base[ltv_col] * base[weight_col]
+    sums = base.groupby(FALLBACK_KEYS)[['_weighted', weight_col]].sum()
+    fallback_ref = (sums['_weighted'] / sums[weight_col]).reset_index(name=FALLBACK_COL)
+    return fallback_ref
+
+
+def apply_fallback(df_rows, fallback_ref, gav_col):
+    """Estimated Lien 1 debt for each row from the fallback table.
+
+    Returns a frame aligned to df_rows.index with 'Fallback Lien 1 Debt' (0 where no
+    fallback exists for the row's Province / Collateral type) and 'Fallback Matched'.
+    """
+    keys = pd.MultiIndex.from_frame(df_rows[FALLBACK_KEYS])
+    ref_index = pd.MultiIndex.from_frame(fallback_ref[FALLBACK_KEYS])
+    pos = ref_index.get_indexer(keys)
+    # Rows with a missing key never matched a fallback row in the original boolean scan
+    pos[df_rows[FALLBACK_KEYS].isna().any(axis=1).to_numpy()] = -1
+    matched = pos >= 0
+
+    ref_ltv = np.append(fallback_ref[FALLBACK_COL].to_numpy(dtype=float), np.nan)
+    fallback_ltv = np.where(matched, ref_ltv[pos], 0.0) / 100
+    gav = df_rows[gav_col].to_numpy(dtype=float)
+    debt = np.where(matched, fallback_ltv * gav, 0.0)
+    return pd.DataFrame({'Fallback Lien 1 Debt': debt, 'Fallback Matched': matched}, index=df_rows.index)
+
+
+def sum_by_key(values, keys):
+    """Group sum that propagates NaN like a plain Python `+=` accumulation does."""
+    values = pd.Series(np.asarray(values, dtype=float), index=keys.index)
+    grouped = values.groupby(keys)
+    sums = grouped.sum()
+    sums[values.isna().groupby(keys).any()] = np.nan
+    return sums
+
+
+def estimate_gt1_lien1_debt(df_lien_gt1, df_lien1, fallback_ref, debt_col, gav_col):
+    """Estimated Lien 1 debt ahead of each Lien >1 loan, one row per loan.
+
+    Assets carrying Lien 1 loans contribute the debt of each distinct Lien 1 loan once per
+    Lien >1 loan; assets without any Lien 1 loan contribute the fallback estimate instead.
+    """
+    loan_keys = df_lien_gt1['Loan reference']
+    loan_index = pd.Index(loan_keys.dropna().unique()).sort_values()
+    loan_to_debt = dict(zip(df_lien1['Loan reference'], df_lien1[debt_col]))
+
+    lien1_pairs = df_lien1[['Asset ID', 'Loan reference']].drop_duplicates().rename(columns={'Loan reference': 'Lien 1 Loan'})
+    gt1_pairs = df_lien_gt1[['Loan reference', 'Asset ID']].merge(lien1_pairs, on='Asset ID')
+    gt1_pairs = gt1_pairs.drop_duplicates(['Loan reference', 'Lien 1 Loan'])
+    lien1_debt = sum_by_key(gt1_pairs['Lien 1 Loan'].map(loan_to_debt), gt1_pairs['Loan reference'])
+
+    no_lien1 = ~df_lien_gt1['Asset ID'].isin(lien1_pairs['Asset ID'])
+    fallback = apply_fallback(df_lien_gt1[no_lien1], fallback_ref, gav_col)
+    fallback_debt = sum_by_key(fallback['Fallback Lien 1 Debt'], loan_keys[no_lien1])
+    fallback_used = fallback['Fallback Matched'].groupby(loan_keys[no_lien1]).any()
+
+    return pd.DataFrame({
+        'Estimated Lien 1 Debt': lien1_debt.reindex(loan_index, fill_value=0.0) + fallback_debt.reindex(loan_index, fill_value=0.0),
+        'Used Fallback': fallback_used.reindex(loan_index, fill_value=False).astype(bool)
+    }, index=loan_index)
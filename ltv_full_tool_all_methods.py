@@ -1,28 +1,20 @@
 # LTV TOOL: All 4 Methods (Loan-Level, Borrower-Level, Fallback, Component)
 import pandas as pd
-import networkx as nx
+from ltv_components import aggregate_components, join_members, label_components
+from ltv_export import write_result
+from ltv_fallback import build_fallback_table, estimate_gt1_lien1_debt
+from ltv_ingest import read_datatape_columns
 
 def load_clean_data(filepath):
-    rows_to_drop = list(range(0, 4)) + [5, 6]
-    df_loans = pd.read_excel(filepath, sheet_name='2.-Loan', header=None)
-    df_collateral = pd.read_excel(filepath, sheet_name='4.-Loan & Collateral', header=None)
-
-    df_loans = df_loans.drop(index=rows_to_drop).reset_index(drop=True)
-    df_collateral = df_collateral.drop(index=rows_to_drop).reset_index(drop=True)
-
-    df_loans.columns = df_loans.iloc[0]
-    df_loans = df_loans.drop(index=0).reset_index(drop=True)
-    df_collateral.columns = df_collateral.iloc[0]
-    df_collateral = df_collateral.drop(index=0).reset_index(drop=True)
-
-    df_loans = df_loans[['Loan reference', 'Total outstanding debt as of 29.02.2024', 'Borrower reference']]
-    df_collateral = df_collateral[['Loan reference', 'Collateral unit reference', 'Plot',
-                                   'Gross Appraisal Value', 'Priority Ranking', 'Collateral type', 'Province']]
-    df_collateral = df_collateral[df_collateral['Gross Appraisal Value'] != 'n.a.']
-
+    df_loans = read_datatape_columns(filepath, '2.-Loan',
+                                     ['Loan reference', 'Total outstanding debt as of 29.02.2024', 'Borrower reference'],
+                                     numeric_columns=['Total outstanding debt as of 29.02.2024'])
+    df_collateral = read_datatape_columns(filepath, '4.-Loan & Collateral',
+                                          ['Loan reference', 'Collateral unit reference', 'Plot',
+                                           'Gross Appraisal Value', 'Priority Ranking', 'Collateral type', 'Province'],
+                                          numeric_columns=['Gross Appraisal Value'],
+                                          drop_values={'Gross Appraisal Value': 'n.a.'})
     df_collateral['Asset ID'] = df_collateral['Collateral unit reference'].astype(str) + '__' + df_collateral['Plot'].astype(str)
-    df_loans['Total outstanding debt as of 29.02.2024'] = pd.to_numeric(df_loans['Total outstanding debt as of 29.02.2024'], errors='coerce')
-    df_collateral['Gross Appraisal Value'] = pd.to_numeric(df_collateral['Gross Appraisal Value'], errors='coerce')
 
     return df_loans, df_collateral
 
@@ -50,29 +42,27 @@ def calculate_loan_level_ltv(df_loans, df_collateral):
 # --- Method 2: Borrower-Level LTV ---
 def calculate_borrower_based_ltv(df_loans, df_collateral):
     loan_to_borrower = df_loans.set_index('Loan reference')['Borrower reference'].to_dict()
-    df_collateral['Borrower reference'] = df_collateral['Loan reference'].map(loan_to_borrower)
-    borrower_records = []
-
-    for borrower in df_loans['Borrower reference'].unique():
-        borrower_loans = df_loans[df_loans['Borrower reference'] == borrower]
-        borrower_assets = df_collateral[df_collateral['Borrower reference'] == borrower]
-        total_debt = borrower_loans['Total outstanding debt as of 29.02.2024'].sum()
-        total_gav = borrower_assets['Gross Appraisal Value'].sum()
-        ltv_total = (total_debt / total_gav * 100) if total_gav > 0 else 0
-        borrower_records.append({
-            'Borrower reference': borrower,
-            'Borrower Loans': ', '.join(map(str, borrower_loans['Loan reference'].tolist())),
-            'Total Debt': total_debt,
-            'Total Appraisal Value': total_gav,
-            'Total LTV (%)': ltv_total
-        })
-    return pd.DataFrame(borrower_records)
+    collateral_borrowers = df_collateral['Loan reference'].map(loan_to_borrower)
+    borrowers = pd.Index(df_loans['Borrower reference'].unique())
+
+    borrower_loans = df_loans.groupby('Borrower reference', sort=False)
+    total_debt = borrower_loans['Total outstanding debt as of 29.02.2024'].sum().reindex(borrowers, fill_value=0)
+    loan_lists = borrower_loans['Loan reference'].agg(lambda refs: ', '.join(map(str, refs))).reindex(borrowers, fill_value='')
+    total_gav = df_collateral['Gross Appraisal Value'].groupby(collateral_borrowers).sum().reindex(borrowers, fill_value=0)
+    ltv_total = (total_debt / total_gav * 100).where(total_gav > 0, 0)
+
+    return pd.DataFrame({
+        'Borrower reference': borrowers,
+        'Borrower Loans': loan_lists.to_numpy(),
+        'Total Debt': total_debt.to_numpy(),
+        'Total Appraisal Value': total_gav.to_numpy(),
+        'Total LTV (%)': ltv_total.to_numpy()
+    })
 
 
 # --- Method 3: Loan-Level LTV with Fallback ---
 def calculate_loan_level_ltv_with_fallback(df_loans, df_collateral):
     df_merged = pd.merge(df_collateral, df_loans, on='Loan reference', how='left')
-    loan_lien_positions = df_merged.groupby('Loan reference')['Priority Ranking'].unique().apply(list).to_dict()
     df_lien1 = df_merged[df_merged['Priority Ranking'] == 'Lien 1'].copy()
     df_lien_gt1 = df_merged[df_merged['Priority Ranking'] != 'Lien 1'].copy()
 
@@ -91,65 +81,30 @@ def calculate_loan_level_ltv_with_fallback(df_loans, df_collateral):
     df_lien1_result['Aggressive LTV (%)'] = df_lien1_result['Total outstanding debt as of 29.02.2024'] / df_lien1_result['Allocated AV Aggressive'] * 100
     df_lien1_result['Used Fallback'] = False
 
-    fallback_base = df_lien1_result.merge(
-        df_merged[['Loan reference', 'Province', 'Collateral type']].drop_duplicates(),
-        on='Loan reference', how='left')
-    fallback_ref = fallback_base.groupby(['Province', 'Collateral type']).apply(
-        lambda g: (g['Conservative LTV (%)'] * g['Total outstanding debt as of 29.02.2024']).sum() /
-                  g['Total outstanding debt as of 29.02.2024'].sum()
-    ).reset_index(name='Weighted Avg Lien1 LTV')
-
-    asset_to_lien1_loans = df_lien1[['Asset ID', 'Loan reference']].drop_duplicates().groupby('Asset ID')['Loan reference'].apply(list).to_dict()
-    loan_to_debt = dict(zip(df_lien1['Loan reference'], df_lien1['Total outstanding debt as of 29.02.2024']))
-    loan_to_lien1_av = df_lien1.groupby('Loan reference')['Allocated AV Conservative'].sum().to_dict()
-
-    loan_group_list = []
-    mixed_lien_loans = [loan for loan, positions in loan_lien_positions.items() if 'Lien 1' in positions and any(pos != 'Lien 1' for pos in positions)]
-
-    for loan_ref, group in df_lien_gt1.groupby('Loan reference'):
-        total_av = group['Gross Appraisal Value'].sum()
-        borrower = group['Borrower reference'].iloc[0]
-        loan_outstanding = group['Total outstanding debt as of 29.02.2024'].iloc[0]
-        seen_lien1_loans = set()
-        lien1_total_debt = 0
-        fallback_used = False
-
-        for _, row in group.iterrows():
-            asset = row['Asset ID']
-            province = row['Province']
-            ctype = row['Collateral type']
-            gross_av = row['Gross Appraisal Value']
-            lien1_loans_on_asset = asset_to_lien1_loans.get(asset, [])
-            if lien1_loans_on_asset:
-                for lien1_loan in lien1_loans_on_asset:
-                    if lien1_loan not in seen_lien1_loans and lien1_loan in loan_to_debt:
-                        lien1_total_debt += loan_to_debt[lien1_loan]
-                        seen_lien1_loans.add(lien1_loan)
-            else:
-                fallback_row = fallback_ref[(fallback_ref['Province'] == province) & (fallback_ref['Collateral type'] == ctype)]
-                if not fallback_row.empty:
-                    fallback_ltv = fallback_row['Weighted Avg Lien1 LTV'].values[0] / 100
-                    lien1_total_debt += fallback_ltv * gross_av
-                    fallback_used = True
-
-        allocated_av_gt1 = total_av - lien1_total_debt if total_av > lien1_total_debt else 0
-        additional_lien1_av = loan_to_lien1_av.get(loan_ref, 0) if loan_ref in mixed_lien_loans else 0
-        total_allocated_av = allocated_av_gt1 + additional_lien1_av
-        conservative_ltv = loan_outstanding / total_allocated_av * 100 if total_allocated_av > 0 else 0
-        aggressive_ltv = loan_outstanding / total_av * 100 if total_av > 0 else 0
-
-        loan_group_list.append({
-            'Loan reference': loan_ref,
-            'Borrower reference': borrower,
-            'Total outstanding debt as of 29.02.2024': loan_outstanding,
-            'Allocated AV Conservative': total_allocated_av,
-            'Allocated AV Aggressive': total_av,
-            'Conservative LTV (%)': conservative_ltv,
-            'Aggressive LTV (%)': aggressive_ltv,
-            'Used Fallback': fallback_used
-        })
-
-    df_gt1_result = pd.DataFrame(loan_group_list)
+    fallback_ref = build_fallback_table(df_lien1_result, df_merged, 'Conservative LTV (%)', 'Total outstanding debt as of 29.02.2024')
+    loan_to_lien1_av = df_lien1.groupby('Loan reference')['Allocated AV Conservative'].sum()
+
+    gt1_first = df_lien_gt1.drop_duplicates('Loan reference').set_index('Loan reference')
+    gt1_estimate = estimate_gt1_lien1_debt(df_lien_gt1, df_lien1, fallback_ref,
+                                           'Total outstanding debt as of 29.02.2024', 'Gross Appraisal Value')
+    total_av = df_lien_gt1.groupby('Loan reference')['Gross Appraisal Value'].sum().reindex(gt1_estimate.index)
+    lien1_total_debt = gt1_estimate['Estimated Lien 1 Debt']
+    loan_outstanding = gt1_first['Total outstanding debt as of 29.02.2024'].reindex(gt1_estimate.index)
+
+    # Loans holding both Lien 1 and Lien >1 positions keep their Lien 1 allocation on top
+    allocated_av_gt1 = (total_av - lien1_total_debt).where(total_av > lien1_total_debt, 0)
+    total_allocated_av = allocated_av_gt1 + loan_to_lien1_av.reindex(gt1_estimate.index, fill_value=0)
+
+    df_gt1_result = pd.DataFrame({
+        'Loan reference': gt1_estimate.index,
+        'Borrower reference': gt1_first['Borrower reference'].reindex(gt1_estimate.index).to_numpy(),
+        'Total outstanding debt as of 29.02.2024': loan_outstanding.to_numpy(),
+        'Allocated AV Conservative': total_allocated_av.to_numpy(),
+        'Allocated AV Aggressive': total_av.to_numpy(),
+        'Conservative LTV (%)': (loan_outstanding / total_allocated_av * 100).where(total_allocated_av > 0, 0).to_numpy(),
+        'Aggressive LTV (%)': (loan_outstanding / total_av * 100).where(total_av > 0, 0).to_numpy(),
+        'Used Fallback': gt1_estimate['Used Fallback'].to_numpy()
+    })
     df_combined = pd.concat([df_lien1_result, df_gt1_result], axis=0)
 
     return df_combined
@@ -159,41 +114,17 @@ def calculate_loan_level_ltv_with_fallback(df_loans, df_collateral):
 def calculate_comp_based_ltv_expanded(df_loans, df_collateral):
     df_merged = pd.merge(df_collateral, df_loans, on='Loan reference', how='left')
     df_collateral['Asset ID'] = df_collateral['Collateral unit reference'].astype(str) + '__' + df_collateral['Plot'].astype(str)
-    G = nx.Graph()
-    for _, row in df_merged.iterrows():
-        G.add_edge('L_' + str(row['Loan reference']), 'A_' + str(row['Asset ID']))
-    components = list(nx.connected_components(G))
-    expanded_records = []
-
-    for comp in components:
-        loans = [node[2:] for node in comp if node.startswith('L_')]
-        assets = [node[2:] for node in comp if node.startswith('A_')]
-        comp_links = df_merged[df_merged['Loan reference'].isin(loans) & df_merged['Asset ID'].isin(assets)]
-
-        total_gav = comp_links[['Asset ID', 'Gross Appraisal Value']].drop_duplicates()['Gross Appraisal Value'].sum()
-        lien1_loans = comp_links[comp_links['Priority Ranking'] == 'Lien 1'].copy()
-        gt1_loans = comp_links[comp_links['Priority Ranking'] != 'Lien 1'].copy()
-        total_lien1_debt = lien1_loans[['Loan reference', 'Total outstanding debt as of 29.02.2024']].drop_duplicates()['Total outstanding debt as of 29.02.2024'].sum()
-        total_lien_gt1_debt = gt1_loans[['Loan reference', 'Total outstanding debt as of 29.02.2024']].drop_duplicates()['Total outstanding debt as of 29.02.2024'].sum()
-        adjusted_av_gt1 = total_gav - total_lien1_debt if total_gav > total_lien1_debt else 0
-        ltv_total = (total_lien1_debt + total_lien_gt1_debt) / total_gav * 100 if total_gav else 0
-        ltv_lien1 = total_lien1_debt / total_gav * 100 if total_gav else 0
-        ltv_lien_gt1 = total_lien_gt1_debt / adjusted_av_gt1 * 100 if adjusted_av_gt1 else 0
-
-        for loan in loans:
-            expanded_records.append({
-                'Component Loan': loan,
-                'Component Assets': ', '.join(assets),
-                'Component Total outstanding debt as of 29.02.2024': total_lien1_debt + total_lien_gt1_debt,
-                'Total Lien 1 Debt': total_lien1_debt,
-                'Total Lien > 1 Debt': total_lien_gt1_debt,
-                'Lien 1 LTV %': ltv_lien1,
-                'Lien > 1 LTV %': ltv_lien_gt1,
-                'Component Gross AV': total_gav,
-                'Component LTV (%)': ltv_total
-            })
-
-    return pd.DataFrame(expanded_records)
+    link_labels, loan_labels, asset_labels = label_components(df_merged['Loan reference'], df_merged['Asset ID'])
+    df_comp = aggregate_components(df_merged, link_labels, 'Total outstanding debt as of 29.02.2024', 'Gross Appraisal Value')
+    df_comp['Component Assets'] = join_members(asset_labels)
+    df_comp['Component Total outstanding debt as of 29.02.2024'] = df_comp['Total Lien 1 Debt'] + df_comp['Total Lien > 1 Debt']
+
+    loan_labels = loan_labels.sort_values(kind='stable')
+    df_result = df_comp.reindex(loan_labels.to_numpy())[[
+        'Component Assets', 'Component Total outstanding debt as of 29.02.2024', 'Total Lien 1 Debt',
+        'Total Lien > 1 Debt', 'Lien 1 LTV %', 'Lien > 1 LTV %', 'Component Gross AV', 'Component LTV (%)']].reset_index(drop=True)
+    df_result.insert(0, 'Component Loan', loan_labels.index.to_numpy())
+    return df_result
 
 
 def main():
@@ -210,19 +141,19 @@ def main():
 
     if choice == '1':
         result = calculate_loan_level_ltv(df_loans, df_collateral)
-        result.to_excel("ltv_loan_level.xlsx", index=False)
+        write_result(result, "ltv_loan_level.xlsx")
         print("Loan-Level LTV exported to 'ltv_loan_level.xlsx'")
     elif choice == '2':
         result = calculate_borrower_based_ltv(df_loans, df_collateral)
-        result.to_excel("ltv_borrower_level.xlsx", index=False)
+        write_result(result, "ltv_borrower_level.xlsx")
         print("Borrower-Level LTV exported to 'ltv_borrower_level.xlsx'")
     elif choice == '3':
         result = calculate_loan_level_ltv_with_fallback(df_loans, df_collateral)
-        result.to_excel("ltv_loan_with_fallback.xlsx", index=False)
+        write_result(result, "ltv_loan_with_fallback.xlsx")
         print("Loan-Level LTV with Fallback exported to 'ltv_loan_with_fallback.xlsx'")
     elif choice == '4':
         result = calculate_comp_based_ltv_expanded(df_loans, df_collateral)
-        result.to_excel("ltv_component_based.xlsx", index=False)
+        write_result(result, "ltv_component_based.xlsx")
         print("Component-Based LTV exported to 'ltv_component_based.xlsx'")
     else:
         print("Invalid choice. Please enter a number from 1 to 4.")
@@ -0,0 +1,103 @@
+# Incremental month-over-month LP runs: re-solve only the components a new tape touches.
+#
+# A snapshot keeps the previous run's component problems and results. The new tape is diffed
+# against it on exactly what the LP sees - each loan's exposure, lien class and pledged assets,
+# each asset's value - and only components containing a changed loan or asset are re-solved.
+# The snapshot also records the LP backend and fast-path setting it was solved with; a run with
+# different settings ignores it and re-solves every component.
+import os
+
+import pandas as pd
+
+from ltv_lp import build_component_problems, solve_component_problems
+
+
+def problem_nodes(problems):
+    """Per-loan and per-asset LP inputs across all component problems."""
+    loans, assets = {}, {}
+    for problem in problems:
+        pledged = {}
+        for loan, asset in problem["Links"]:
+            pledged.setdefault(loan, set()).add(asset)
+        for lien, exposures in (("Lien1", problem["Loans_Lien1"]), ("LienGT1", problem["Loans_LienGT1"])):
+            for loan, exposure in exposures.items():
+                loans[loan] = (lien, exposure, frozenset(pledged.get(loan, ())))
+        assets.update(problem["Collaterals"])
+    return loans, assets
+
+
+def _changed(previous, current):
+    # NaN exposures / values never compare equal, so their loans and assets are always re-solved
+    return {key for key in previous.keys() | current.keys()
+            if key not in previous or key not in current or previous[key] != current[key]}
+
+
+def diff_problems(previous_problems, problems):
+    """Loans and assets whose LP inputs differ between two runs (added and removed included)."""
+    previous_loans, previous_assets = problem_nodes(previous_problems)
+    loans, assets = problem_nodes(problems)
+    return _changed(previous_loans, loans), _changed(previous_assets, assets)
+
+
+def _same_problem(a, b):
+    # Same content in the same order, so the solver sees exactly the model a full run builds
+    return (a["Links"] == b["Links"] and
+            all(list(a[key].items()) == list(b[key].items()) for key in ("Loans_Lien1", "Loans_LienGT1", "Collaterals")))
+
+
+def solve_component_problems_incremental(problems, snapshot=None, solver=None, workers=None, cache_path=None,
+                                         backend="pulp", fast_path=True):
+    """solve_component_problems() that reuses snapshot results for untouched components.
+
+    Returns (results, snapshot) where the new snapshot is to be stored for the next run.
+    """
+    settings = {"backend": backend, "fast_path": fast_path}
+    if snapshot is not None and snapshot.get("settings") != settings:
+        print(f"Incremental LP: snapshot was solved with {snapshot.get('settings')}, not {settings}; "
+              f"re-solving everything")
+        snapshot = None
+
+    results = [None] * len(problems)
+    if snapshot is not None:
+        changed_loans, changed_assets = diff_problems(snapshot["problems"], problems)
+        previous_by_loan = {}
+        for previous, result in zip(snapshot["problems"], snapshot["results"]):
+            for loan in list(previous["Loans_Lien1"]) + list(previous["Loans_LienGT1"]):
+                previous_by_loan[loan] = (previous, result)
+
+        for idx, problem in enumerate(problems):
+            loans = list(problem["Loans_Lien1"]) + list(problem["Loans_LienGT1"])
+            if changed_loans.intersection(loans) or changed_assets.intersection(problem["Collaterals"]):
+                continue
+            previous, result = previous_by_loan.get(loans[0], (None, None))
+            if previous is not None and _same_problem(previous, problem):
+                results[idx] = result
+
+    to_solve = [idx for idx, result in enumerate(results) if result is None]
+    print(f"Incremental LP: reusing {len(problems) - len(to_solve)} of {len(problems)} components, "
+          f"re-solving {len(to_solve)}")
+    if to_solve:
+        solved = solve_component_problems([problems[idx] for idx in to_solve], solver=solver, workers=workers,
+                                          fast_path=fast_path, cache_path=cache_path, backend=backend)
+        for idx, result in zip(to_solve, solved):
+            results[idx] = result
+    return results, {"problems": problems, "results": results, "settings": settings}
+
+
+def load_snapshot(snapshot_path):
+    """Previous run's snapshot, or None when there is none yet."""
+    return pd.read_pickle(snapshot_path) if snapshot_path and os.path.exists(snapshot_path) else None
+
+
+def save_snapshot(snapshot_path, snapshot):
+    pd.to_pickle(snapshot, snapshot_path)
+
+
+def run_lp_incremental(df_loans, df_collateral, snapshot_path, solver=None, workers=None, cache_path=None,
+                       backend="pulp", fast_path=True, **problem_cols):
+    """Component LP results for a tape, re-solving only what changed since snapshot_path."""
+    problems = build_component_problems(df_loans, df_collateral, **problem_cols)
+    results, snapshot = solve_component_problems_incremental(problems, load_snapshot(snapshot_path), solver, workers,
+                                                             cache_path, backend, fast_path)
+    save_snapshot(snapshot_path, snapshot)
+    return results
@@ -0,0 +1,270 @@
+# Datatape ingestion: sheets parsed once, then served from a Parquet sidecar cache.
+#
+# read_datatape_columns() streams only the needed columns out of a sheet in openpyxl read-only
+# mode. The cache lives in a '.ltv_cache' directory next to the workbook (or cache_dir). Each
+# column selection of a sheet is stored under the workbook's SHA-256; a small manifest remembers
+# the mtime / size the hash was taken at, so unchanged workbooks are not even re-hashed. Editing
+# the workbook changes its hash and the stale sheets are replaced on the next read.
+import datetime
+import hashlib
+import json
+import os
+import re
+import tempfile
+from array import array
+
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+from openpyxl.cell.cell import ERROR_CODES
+
+from ltv_profile import span
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is optional; without it every read parses the workbook
+    pa = None
+
+CACHE_DIRNAME = '.ltv_cache'
+
+# Datatape sheet layout: rows 0-3 are banners, row 4 the header, rows 5-6 descriptions
+HEADER_ROW = 4
+SKIP_ROWS = (5, 6)
+_STRING_DTYPE = pd.Series(['']).dtype
+
+# Strings read as missing, as pd.read_excel / read_csv do by default (the documented na_values list)
+NA_VALUES = frozenset({'', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+                       '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'})
+
+# Streamed text columns are object columns that may mix strings, numbers and dates; each
+# Python type goes to its own typed Parquet column so values round-trip exactly.
+_KINDS = ('int', 'float', 'datetime', 'bool', 'str')
+
+
+def _value_kind(v):
+    if isinstance(v, (bool, np.bool_)):
+        return 'bool'
+    if isinstance(v, (int, np.integer)):
+        return 'int'
+    if isinstance(v, (float, np.floating)):
+        return 'float'
+    if isinstance(v, (datetime.date, np.datetime64)):
+        return 'datetime'
+    return 'str'
+
+
+def _encode_frame(df):
+    arrays, names, dtypes = [], [], {}
+    for pos in range(df.shape[1]):
+        column = df.iloc[:, pos]
+        if column.dtype != object:
+            native = column.to_numpy() if column.dtype.kind in 'biufM' else column.to_numpy(dtype=object)
+            arrays.append(pa.array(native, from_pandas=True))
+            names.append(f'{pos}:native')
+            dtypes[pos] = str(column.dtype)
+            continue
+        values = column.to_numpy(dtype=object)
+        missing = pd.isna(values)
+        kinds = np.array([_value_kind(v) for v in values], dtype=object)
+        kinds[missing] = ''
+        for kind in _KINDS:
+            mask = kinds == kind
+            if not mask.any():
+                continue
+            part = np.where(mask, values, None)
+            if kind == 'str':
+                part = np.array([None if v is None else str(v) for v in part], dtype=object)
+            elif kind == 'datetime':
+                part = pd.to_datetime(pd.Series(part), errors='coerce')
+            arrays.append(pa.array(part, from_pandas=True))
+            names.append(f'{pos}:{kind}')
+    if not isinstance(df.index, pd.RangeIndex) or df.index.start != 0 or df.index.step != 1:
+        arrays.append(pa.array(df.index.to_numpy(dtype=np.int64)))
+        names.append('index:native')
+    header = {'columns': [None if pd.isna(c) else c for c in df.columns], 'columns_dtype': str(df.columns.dtype),
+              'n_rows': len(df), 'dtypes': dtypes}
+    table = pa.Table.from_arrays(arrays, names=names) if arrays else pa.table({})
+    return table.replace_schema_metadata({'ltv_ingest': json.dumps(header, default=str)})
+
+
+def _decode_table(table):
+    header = json.loads(table.schema.metadata[b'ltv_ingest'])
+    n_rows = header['n_rows']
+    columns = [np.full(n_rows, np.nan, dtype=object) for _ in header['columns']]
+    index = pd.RangeIndex(n_rows)
+    for name, chunked in zip(table.column_names, table.columns):
+        pos, kind = name.split(':')
+        if pos == 'index':
+            index = pd.Index(chunked.to_numpy(), dtype=np.int64)
+        elif kind == 'native':
+            columns[int(pos)] = pd.array(chunked.to_numpy(zero_copy_only=False), dtype=header['dtypes'][pos])
+        else:
+            part = (np.array(chunked.to_pylist(), dtype=object) if kind == 'datetime'
+                    else chunked.to_pandas(integer_object_nulls=True).to_numpy(dtype=object))
+            present = ~pd.isna(part)
+            columns[int(pos)][present] = part[present]
+    names = [np.nan if c is None else c for c in header['columns']]
+    return pd.DataFrame(dict(enumerate(columns)), index=index).set_axis(pd.Index(names, dtype=header['columns_dtype']), axis=1)
+
+
+def _file_sha256(filepath, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def workbook_key(filepath, cache_dir):
+    """SHA-256 of the workbook, reusing the manifest hash while mtime and size are unchanged."""
+    stat = os.stat(filepath)
+    manifest_path = os.path.join(cache_dir, os.path.basename(filepath) + '.json')
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest['mtime_ns'] == stat.st_mtime_ns and manifest['size'] == stat.st_size:
+            return manifest['sha256']
+    except (OSError, ValueError, KeyError):
+        manifest = {}
+
+    sha256 = _file_sha256(filepath)
+    # The workbook changed: drop the sheets cached under its previous hash
+    if manifest.get('sha256') and manifest['sha256'] != sha256:
+        for name in os.listdir(cache_dir):
+            if name.startswith(manifest['sha256'][:20] + '__'):
+                os.remove(os.path.join(cache_dir, name))
+    manifest = {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'sha256': sha256}
+    _atomic_write(manifest_path, lambda path: _write_json(path, manifest))
+    return sha256
+
+
+def _write_json(path, obj):
+    with open(path, 'w') as f:
+        json.dump(obj, f)
+
+
+def _atomic_write(path, write):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    os.close(fd)
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _cache_path(filepath, sheet_name, cache_dir, selection):
+    cache_dir = cache_dir or os.path.join(os.path.dirname(os.path.abspath(filepath)), CACHE_DIRNAME)
+    os.makedirs(cache_dir, exist_ok=True)
+    sheet_slug = re.sub(r'[^0-9A-Za-z]+', '_', sheet_name).strip('_')
+    sheet_slug += '__' + hashlib.sha256(json.dumps(selection, sort_keys=True).encode()).hexdigest()[:12]
+    return os.path.join(cache_dir, f'{workbook_key(filepath, cache_dir)[:20]}__{sheet_slug}.parquet')
+
+
+def _cell_value(v):
+    """Cell value as pd.read_excel reports it: errors / NA strings to NaN, integral floats to int."""
+    if v is None:
+        return np.nan
+    if isinstance(v, str):
+        return np.nan if v in NA_VALUES or v in ERROR_CODES else v
+    if isinstance(v, float) and v.is_integer():
+        return int(v)
+    return v
+
+
+def _to_float(v):
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def stream_datatape_columns(filepath, sheet_name, columns, numeric_columns=(), drop_values=None):
+    """Selected columns of a datatape sheet, read row by row in openpyxl read-only mode.
+
+    Same frame as reading the whole sheet with header=None, dropping the banner / description
+    rows, promoting the header, subsetting to columns, dropping rows where a column equals
+    drop_values[col] and applying pd.to_numeric(errors='coerce') to numeric_columns; but only
+    the selected cells are ever held in memory. The index keeps the data row numbers.
+    """
+    numeric_columns = set(numeric_columns)
+    workbook = load_workbook(filepath, read_only=True, data_only=True)
+    try:
+        sheet = workbook[sheet_name]
+        sheet.reset_dimensions()
+        rows = sheet.iter_rows(values_only=True)
+        for _ in range(HEADER_ROW):
+            next(rows, None)
+        header = [_cell_value(v) for v in next(rows, None) or ()]
+        missing = [col for col in columns if col not in header]
+        if missing:
+            raise KeyError(f"{missing} not in sheet '{sheet_name}'")
+        positions = [header.index(col) for col in columns]
+        drops = [(header.index(col), value) for col, value in (drop_values or {}).items()]
+        for _ in SKIP_ROWS:
+            next(rows, None)
+
+        values = {col: array('d') if col in numeric_columns else [] for col in columns}
+        all_int = dict.fromkeys(numeric_columns, True)
+        index, pending_empty = [], []
+
+        def append(row_number, row):
+            for col, pos in zip(columns, positions):
+                v = _cell_value(row[pos]) if pos < len(row) else np.nan
+                if col in numeric_columns:
+                    all_int[col] = all_int[col] and type(v) is int
+                    values[col].append(_to_float(v))
+                else:
+                    values[col].append(v)
+            index.append(row_number)
+
+        for row_number, row in enumerate(rows):
+            if all(v is None for v in row):
+                pending_empty.append(row_number)
+                continue
+            # Empty rows are kept as NaN rows unless they trail the sheet, as pd.read_excel does
+            for empty_number in pending_empty:
+                append(empty_number, ())
+            pending_empty = []
+            if not any(pos < len(row) and _cell_value(row[pos]) == value for pos, value in drops):
+                append(row_number, row)
+    finally:
+        workbook.close()
+
+    data = {}
+    for col in columns:
+        if col in numeric_columns:
+            data[col] = np.frombuffer(values[col], dtype=float)
+            if all_int[col] and index:
+                data[col] = data[col].astype(np.int64)
+        elif all(isinstance(v, str) for v in values[col] if v == v):
+            # read_excel infers the default string dtype for text-only columns
+            data[col] = pd.array(values[col], dtype=_STRING_DTYPE)
+        else:
+            data[col] = np.empty(len(index), dtype=object)
+            data[col][:] = values[col]
+    return pd.DataFrame(data, index=pd.Index(index, dtype=np.int64), columns=pd.Index(columns, dtype=object))
+
+
+def read_datatape_columns(filepath, sheet_name, columns, numeric_columns=(), drop_values=None,
+                          cache_dir=None, use_cache=True):
+    """stream_datatape_columns() served from the Parquet cache, keyed by workbook and selection."""
+    with span('read', sheet=sheet_name) as stage:
+        if pa is None or not use_cache:
+            df = stream_datatape_columns(filepath, sheet_name, columns, numeric_columns, drop_values)
+            stage.count(rows=len(df), cached=False)
+            return df
+
+        selection = {'columns': list(columns), 'numeric': sorted(numeric_columns), 'drop': drop_values or {}}
+        cache_path = _cache_path(filepath, sheet_name, cache_dir, selection)
+        if os.path.exists(cache_path):
+            df = _decode_table(pq.read_table(cache_path, memory_map=True))
+            stage.count(rows=len(df), cached=True)
+            return df
+
+        df = stream_datatape_columns(filepath, sheet_name, columns, numeric_columns, drop_values)
+        _atomic_write(cache_path, lambda path: pq.write_table(_encode_frame(df), path))
+        stage.count(rows=len(df), cached=False)
+        return df
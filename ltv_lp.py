@@ -0,0 +1,442 @@
+# LP-based collateral allocation: one min-max-LTV problem per connected component
+import math
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+import pandas as pd
+from pulp import LpProblem, LpVariable, LpMaximize, lpSum, LpStatus, value
+from scipy.optimize import linprog
+from scipy.sparse import csr_matrix
+
+from ltv_components import component_links, component_members, label_components
+from ltv_lp_cache import ComponentSolutionCache
+from ltv_profile import profiled, span
+
+
+# === Component problems ===
+@profiled("lp.build")
+def build_component_problems(df_loans, df_collateral, loan_col="Loan reference",
+                             debt_col="Total outstanding debt as of 29.02.2024",
+                             priority_col="Priority Ranking", gav_col="Gross Appraisal Value"):
+    """One LP input per connected component: exposures by lien, collateral values and links."""
+    link_labels, loan_labels, asset_labels = label_components(df_collateral[loan_col], df_collateral["Asset ID"])
+
+    # First loan-tape exposure, first collateral lien rank and first appraisal value per key
+    loan_exposure = df_loans.drop_duplicates(loan_col).set_index(loan_col)[debt_col].to_dict()
+    loan_lien = df_collateral.drop_duplicates(loan_col).set_index(loan_col)[priority_col].to_dict()
+    asset_value = df_collateral.drop_duplicates("Asset ID").set_index("Asset ID")[gav_col].to_dict()
+
+    members = component_members(loan_labels, asset_labels)
+    links = component_links(link_labels, df_collateral[loan_col], df_collateral["Asset ID"])
+    problems = []
+
+    for (loans, assets), comp_links in zip(members, links):
+        loans_lien1, loans_lien_gt1 = {}, {}
+        for loan in loans:
+            if loan in loan_exposure:
+                if loan_lien[loan] == "Lien 1":
+                    loans_lien1[loan] = loan_exposure[loan]
+                else:
+                    loans_lien_gt1[loan] = loan_exposure[loan]
+
+        if not loans_lien1 and not loans_lien_gt1:
+            continue
+
+        problems.append({
+            "Loans_Lien1": loans_lien1,
+            "Loans_LienGT1": loans_lien_gt1,
+            "Collaterals": {asset: asset_value[asset] for asset in assets},
+            "Links": comp_links
+        })
+
+    return problems
+
+
+# === LP model ===
+# Names of the constraints whose right-hand side is a collateral value
+RESIDUAL_PREFIX = "residual_"
+COLLATERAL_PREFIX = "collateral_"
+
+
+def _allocation_pairs(loans_lien1, loans_lien_gt1, collaterals_component, links=None):
+    """Distinct Lien 1 and Lien >1 (loan, asset) pairs that get an allocation variable."""
+    if links is None:
+        links = [(i, j) for i in list(loans_lien1) + list(loans_lien_gt1) for j in collaterals_component]
+    links = [(i, j) for i, j in dict.fromkeys(links) if j in collaterals_component]
+    return [(i, j) for i, j in links if i in loans_lien1], [(i, j) for i, j in links if i in loans_lien_gt1]
+
+
+def build_allocation_lp(loans_lien1, loans_lien_gt1, collaterals_component, links=None):
+    """Min-max-LTV allocation model for one component: (prob, x_L1, x_Lgt1, Z).
+
+    Variables exist only for the (loan, asset) pairs in links, i.e. the pledges on the
+    collateral sheet; with links=None every loan may draw on every asset of the component.
+    """
+    pairs_L1, pairs_Lgt1 = _allocation_pairs(loans_lien1, loans_lien_gt1, collaterals_component, links)
+
+    prob = LpProblem("Collateral_Allocation_Component", LpMaximize)
+    x_L1 = LpVariable.dicts("x_L1", pairs_L1, lowBound=0)
+    x_Lgt1 = LpVariable.dicts("x_Lgt1", pairs_Lgt1, lowBound=0)
+
+    # Z is the inverse of the maximum LTV across loans
+    Z = LpVariable("Z", lowBound=0)
+
+    loan_vars, asset_vars_L1, asset_vars_Lgt1 = defaultdict(list), defaultdict(list), defaultdict(list)
+    for (i, j), var in x_L1.items():
+        loan_vars[i].append(var)
+        asset_vars_L1[j].append(var)
+    for (i, j), var in x_Lgt1.items():
+        loan_vars[i].append(var)
+        asset_vars_Lgt1[j].append(var)
+
+    for i in loans_lien1:
+        prob += lpSum(loan_vars[i]) >= loans_lien1[i] * Z
+    for i in loans_lien_gt1:
+        prob += lpSum(loan_vars[i]) >= loans_lien_gt1[i] * Z
+
+    # Lien >1 loans draw only on what Lien 1 leaves: one residual expression per asset
+    lien1_residual = {j: collaterals_component[j] - lpSum(asset_vars_L1[j]) for j in asset_vars_Lgt1}
+    for n, ((i, j), var) in enumerate(x_Lgt1.items()):
+        prob += var <= lien1_residual[j], f"{RESIDUAL_PREFIX}{n}"
+
+    # Collateral is fully allocated (Lien 1 + Lien >1 must sum to total collateral)
+    for n, j in enumerate(collaterals_component):
+        prob += lpSum(asset_vars_L1[j]) + lpSum(asset_vars_Lgt1[j]) == collaterals_component[j], f"{COLLATERAL_PREFIX}{n}"
+
+    prob += Z
+    return prob, x_L1, x_Lgt1, Z
+
+
+def _pulp_allocation(loans_lien1, loans_lien_gt1, collaterals_component, links=None, solver=None):
+    """PuLP backend: build the model and solve it with solver (CBC by default)."""
+    prob, x_L1, x_Lgt1, Z = build_allocation_lp(loans_lien1, loans_lien_gt1, collaterals_component, links)
+    prob.solve(solver)
+
+    allocation = {"Lien1": {i: {} for i in loans_lien1}, "LienGT1": {i: {} for i in loans_lien_gt1}}
+    for (i, j), var in x_L1.items():
+        allocation["Lien1"][i][j] = value(var)
+    for (i, j), var in x_Lgt1.items():
+        allocation["LienGT1"][i][j] = value(var)
+    return allocation, value(Z), LpStatus[prob.status]
+
+
+_HIGHS_STATUS = {0: "Optimal", 2: "Infeasible", 3: "Unbounded"}
+
+
+def _highs_model(loans_lien1, loans_lien_gt1, collaterals_component, links=None):
+    """The allocation model as sparse arrays: variables are the Lien 1 pairs, the Lien >1 pairs, then Z.
+
+    Returns (pairs, n_lien1_pairs, (rows, cols, data, b) of A_ub x <= b, the same of A_eq x = b).
+    """
+    pairs_L1, pairs_Lgt1 = _allocation_pairs(loans_lien1, loans_lien_gt1, collaterals_component, links)
+    pairs = pairs_L1 + pairs_Lgt1
+    loans = {i: k for k, i in enumerate(list(loans_lien1) + list(loans_lien_gt1))}
+    assets = {j: k for k, j in enumerate(collaterals_component)}
+    n_pairs, n_loans = len(pairs), len(loans)
+    pair_loans = np.array([loans[i] for i, _ in pairs], dtype=np.intp)
+    pair_assets = np.array([assets[j] for _, j in pairs], dtype=np.intp)
+    exposures = np.array([*loans_lien1.values(), *loans_lien_gt1.values()], dtype=float)
+    values = np.array(list(collaterals_component.values()), dtype=float)
+
+    # exposure_i * Z - sum_j x_ij <= 0 for every loan
+    rows = [pair_loans, np.arange(n_loans)]
+    cols = [np.arange(n_pairs), np.full(n_loans, n_pairs)]
+    data = [-np.ones(n_pairs), exposures]
+
+    # x_ij + (Lien 1 draws on j) <= value_j for every Lien >1 pair
+    lien1_on_asset = defaultdict(list)
+    for k, (_, j) in enumerate(pairs_L1):
+        lien1_on_asset[j].append(k)
+    for r, k in enumerate(range(len(pairs_L1), n_pairs)):
+        members = [k] + lien1_on_asset[pairs[k][1]]
+        rows.append(np.full(len(members), n_loans + r))
+        cols.append(np.array(members, dtype=np.intp))
+        data.append(np.ones(len(members)))
+    b_ub = np.concatenate([np.zeros(n_loans), values[pair_assets[len(pairs_L1):]]])
+    ub = (np.concatenate(rows), np.concatenate(cols), np.concatenate(data), b_ub)
+
+    # Every asset is fully allocated
+    eq = (pair_assets, np.arange(n_pairs), np.ones(n_pairs), values)
+    return pairs, len(pairs_L1), ub, eq
+
+
+def _highs_solve(models):
+    """Solve one or more models stacked block-diagonally, maximising the sum of their Z.
+
+    The blocks share no variables, so the joint optimum is each block's own optimum.
+    Returns the linprog result and each model's first variable.
+    """
+    offsets = np.cumsum([0] + [len(pairs) + 1 for pairs, _, _, _ in models])
+    ub_offsets = np.cumsum([0] + [len(ub[3]) for _, _, ub, _ in models])
+    eq_offsets = np.cumsum([0] + [len(eq[3]) for _, _, _, eq in models])
+
+    def stack(part, row_offsets):
+        blocks = [model[part] for model in models]
+        rows = np.concatenate([block[0] + row_offset for block, row_offset in zip(blocks, row_offsets)])
+        cols = np.concatenate([block[1] + offset for block, offset in zip(blocks, offsets)])
+        matrix = csr_matrix((np.concatenate([block[2] for block in blocks]), (rows, cols)),
+                            shape=(row_offsets[-1], offsets[-1]))
+        return matrix, np.concatenate([block[3] for block in blocks])
+
+    A_ub, b_ub = stack(2, ub_offsets)
+    A_eq, b_eq = stack(3, eq_offsets)
+    objective = np.zeros(offsets[-1])
+    objective[offsets[1:] - 1] = -1.0
+    res = linprog(objective, A_ub=A_ub if A_ub.shape[0] else None, b_ub=b_ub if A_ub.shape[0] else None,
+                  A_eq=A_eq if A_eq.shape[0] else None, b_eq=b_eq if A_eq.shape[0] else None,
+                  bounds=(0, None), method="highs")
+    return res, offsets
+
+
+def _highs_unpack(model, loans_lien1, loans_lien_gt1, x):
+    pairs, n_lien1_pairs, _, _ = model
+    allocation = {"Lien1": {i: {} for i in loans_lien1}, "LienGT1": {i: {} for i in loans_lien_gt1}}
+    for k, (i, j) in enumerate(pairs):
+        allocation["Lien1" if k < n_lien1_pairs else "LienGT1"][i][j] = float(x[k])
+    return allocation, float(x[len(pairs)])
+
+
+def _highs_allocation(loans_lien1, loans_lien_gt1, collaterals_component, links=None, solver=None):
+    """HiGHS backend: the model as sparse arrays, solved in-process by scipy's linprog (solver unused)."""
+    model = _highs_model(loans_lien1, loans_lien_gt1, collaterals_component, links)
+    res, _ = _highs_solve([model])
+    if res.x is None:
+        allocation = {"Lien1": {i: {} for i in loans_lien1}, "LienGT1": {i: {} for i in loans_lien_gt1}}
+        return allocation, None, _HIGHS_STATUS.get(res.status, "Not Solved")
+    allocation, optimal_Z = _highs_unpack(model, loans_lien1, loans_lien_gt1, res.x)
+    return allocation, optimal_Z, "Optimal"
+
+
+def _highs_allocation_batch(problems, solver=None):
+    """Many components in one linprog call; a batch that is not optimal as a whole (some
+    component infeasible or unbounded) is solved component by component instead."""
+    models = [_highs_model(p["Loans_Lien1"], p["Loans_LienGT1"], p["Collaterals"], p["Links"]) for p in problems]
+    res, offsets = _highs_solve(models)
+    if res.status != 0:
+        return [_highs_allocation(p["Loans_Lien1"], p["Loans_LienGT1"], p["Collaterals"], p["Links"])
+                for p in problems]
+    return [(*_highs_unpack(model, p["Loans_Lien1"], p["Loans_LienGT1"], res.x[offset:]), "Optimal")
+            for model, p, offset in zip(models, problems, offsets)]
+
+
+# Allocation LP backends: name -> function(loans_lien1, loans_lien_gt1, collaterals, links, solver),
+# and the backends that can also solve a list of component problems in one call
+LP_BACKENDS = {"pulp": _pulp_allocation, "highs": _highs_allocation}
+LP_BATCH_BACKENDS = {"highs": _highs_allocation_batch}
+
+
+def _min_max_ltv(allocation, optimal_Z, status):
+    minimized_max_LTV = 1 / optimal_Z if optimal_Z is not None and optimal_Z > 0 else None
+    return allocation, optimal_Z, minimized_max_LTV, status
+
+
+def lp_allocation_component(loans_lien1, loans_lien_gt1, collaterals_component, links=None, solver=None,
+                            backend="pulp"):
+    """Allocate collateral to maximise Z, the inverse of the largest LTV in the component.
+
+    backend picks the LP backend from LP_BACKENDS; solver is the PuLP solver for "pulp".
+    """
+    return _min_max_ltv(*LP_BACKENDS[backend](loans_lien1, loans_lien_gt1, collaterals_component, links, solver))
+
+
+def lp_allocation_batch(problems, solver=None, backend="pulp", batch_links=2000):
+    """lp_allocation_component() for a list of component problems, in order.
+
+    Backends in LP_BATCH_BACKENDS solve about batch_links links' worth of components per call.
+    """
+    if backend not in LP_BATCH_BACKENDS:
+        return [lp_allocation_component(p["Loans_Lien1"], p["Loans_LienGT1"], p["Collaterals"], p["Links"],
+                                        solver, backend) for p in problems]
+    return [_min_max_ltv(*solved) for batch in _batch_problems(problems, batch_links)
+            for solved in LP_BATCH_BACKENDS[backend](batch, solver)]
+
+
+def closed_form_allocation(loans_lien1, loans_lien_gt1, collaterals_component, links=None):
+    """Analytic min-max-LTV allocation for trivially shaped components, else None.
+
+    A single loan takes every pledged asset in full (Z = total value / exposure); a single
+    asset is split pro rata to exposure (Z = value / total exposure). In both shapes that
+    allocation is the unique LP optimum, so the solver is only needed for shared collateral.
+    """
+    exposures = {**loans_lien1, **loans_lien_gt1}
+    if links is None:
+        links = [(i, j) for i in exposures for j in collaterals_component]
+    links = [(i, j) for i, j in dict.fromkeys(links) if i in exposures and j in collaterals_component]
+
+    # Unpledged assets, missing or negative amounts: leave these to the solver as before
+    if len({j for _, j in links}) != len(collaterals_component):
+        return None
+    amounts = list(exposures.values()) + list(collaterals_component.values())
+    if not all(math.isfinite(amount) and amount >= 0 for amount in amounts):
+        return None
+
+    if len(exposures) > 1 and len(collaterals_component) > 1:
+        return None
+    total_exposure = sum(exposures.values())
+    if total_exposure <= 0:
+        return None
+
+    optimal_Z = sum(collaterals_component.values()) / total_exposure
+    if len(exposures) == 1:
+        allocated = {(i, j): collaterals_component[j] for i, j in links}
+    else:
+        allocated = {(i, j): exposures[i] * optimal_Z for i, j in links}
+
+    allocation = {"Lien1": {i: {} for i in loans_lien1}, "LienGT1": {i: {} for i in loans_lien_gt1}}
+    for (i, j), alloc_value in allocated.items():
+        allocation["Lien1" if i in loans_lien1 else "LienGT1"][i][j] = alloc_value
+
+    minimized_max_LTV = 1 / optimal_Z if optimal_Z > 0 else None
+    return allocation, optimal_Z, minimized_max_LTV, "Optimal"
+
+
+def _solve_batch(batch, solver=None, fast_path=True, cache_path=None, backend="pulp"):
+    """Results for a batch of problems plus the cache's (hits, misses) over the batch."""
+    # Each worker process opens its own connection to the shared solution cache; its reads take
+    # no lock and its writes are buffered until close(), so other workers are never blocked
+    # while this one solves
+    cache = ComponentSolutionCache(cache_path, namespace=backend) if cache_path else None
+    solved, solve_paths = [None] * len(batch), ["Closed form"] * len(batch)
+    for k, problem in enumerate(batch):
+        args = (problem["Loans_Lien1"], problem["Loans_LienGT1"], problem["Collaterals"], problem["Links"])
+        solved[k] = closed_form_allocation(*args) if fast_path else None
+        if solved[k] is None and cache is not None:
+            solved[k], solve_paths[k] = cache.get(problem), "Cache"
+
+    # Everything else goes to the LP backend in one go, so batch-capable backends can stack it
+    pending = [k for k, result in enumerate(solved) if result is None]
+    for k, result in zip(pending, lp_allocation_batch([batch[k] for k in pending], solver, backend)):
+        solved[k], solve_paths[k] = result, "LP solver"
+        if cache is not None:
+            cache.put(batch[k], result)
+
+    results = []
+    for problem, (alloc, opt_Z, min_max_LTV, status), solve_path in zip(batch, solved, solve_paths):
+        results.append({
+            "Loans_Lien1": problem["Loans_Lien1"],
+            "Loans_LienGT1": problem["Loans_LienGT1"],
+            "Collaterals": problem["Collaterals"],
+            "Allocation": alloc,
+            "Opt_Z": opt_Z,
+            "Minimized_Max_LTV": min_max_LTV,
+            "Status": status,
+            "Solve Path": solve_path
+        })
+    cache_counts = (0, 0)
+    if cache is not None:
+        cache.close()
+        cache_counts = (cache.hits, cache.misses)
+    return results, cache_counts
+
+
+def _batch_problems(problems, batch_links):
+    """Consecutive problems grouped until a batch holds at least batch_links links."""
+    batch, size = [], 0
+    for problem in problems:
+        batch.append(problem)
+        size += len(problem["Links"])
+        if size >= batch_links:
+            yield batch
+            batch, size = [], 0
+    if batch:
+        yield batch
+
+
+def solve_component_problems(problems, solver=None, workers=None, batch_links=200, fast_path=True,
+                             cache_path=None, cache_entries=100_000, backend="pulp"):
+    """Solve every component problem and attach the LP results, in component order.
+
+    Trivially shaped components are answered in closed form unless fast_path is False. With
+    workers > 1 the rest go to a process pool; tiny components are batched together (about
+    batch_links links per task) so process overhead stays small. With cache_path, solver
+    results are looked up in / added to a ComponentSolutionCache of at most cache_entries.
+    backend names the LP backend (see LP_BACKENDS) used for the rest.
+    """
+    with span("lp.solve", components=len(problems), backend=backend) as stage:
+        if not workers or workers <= 1:
+            batches = [_solve_batch(problems, solver, fast_path, cache_path, backend)]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                batches = list(executor.map(partial(_solve_batch, solver=solver, fast_path=fast_path,
+                                                    cache_path=cache_path, backend=backend),
+                                            _batch_problems(problems, batch_links)))
+        results = [result for batch, _ in batches for result in batch]
+        cache_hits = sum(hits for _, (hits, _) in batches)
+        cache_misses = sum(misses for _, (_, misses) in batches)
+        path_counts = Counter(result["Solve Path"] for result in results)
+        stage.count(**path_counts)
+        if cache_path:
+            stage.count(cache_hits=cache_hits, cache_misses=cache_misses)
+
+    print(f"Solved {len(results)} components: {path_counts['Closed form']} closed form, "
+          f"{path_counts['LP solver']} with the LP solver")
+    if cache_path:
+        cache = ComponentSolutionCache(cache_path, cache_entries)
+        cache.evict()
+        cache.close()
+        print(f"LP cache: {cache_hits} hits, {cache_misses} misses")
+    return results
+
+
+def allocation_table(results):
+    """Flatten component results to one row per positive (loan, asset) allocation."""
+    allocation_results = []
+    for comp_idx, comp_result in enumerate(results):
+        for lien_type in ["Lien1", "LienGT1"]:
+            for loan, allocs in comp_result["Allocation"][lien_type].items():
+                for asset, alloc_value in allocs.items():
+                    if alloc_value > 0:
+                        allocation_results.append({
+                            "Component": comp_idx + 1,
+                            "Loan Reference": loan,
+                            "Lien Position": "Lien 1" if lien_type == "Lien1" else "Lien >1",
+                            "Asset ID": asset,
+                            "Loan Amount": comp_result["Loans_Lien1"].get(loan, 0) if lien_type == "Lien1" else comp_result["Loans_LienGT1"].get(loan, 0),
+                            "Asset Value": comp_result["Collaterals"].get(asset, 0),
+                            "Allocated Value": alloc_value,
+                            "Allocation %": alloc_value / comp_result["Collaterals"].get(asset, 1) * 100,
+                            "Optimized LTV": comp_result["Minimized_Max_LTV"],
+                            "LP Status": comp_result["Status"]
+                        })
+
+    return pd.DataFrame(allocation_results)
+
+
+# === Uniform haircut sweeps ===
+def _resolve_haircuts(problem, haircuts, solver=None):
+    """Min max LTV per haircut from one model, rescaling only its collateral right-hand sides."""
+    prob, _, _, Z = build_allocation_lp(problem["Loans_Lien1"], problem["Loans_LienGT1"],
+                                        problem["Collaterals"], problem["Links"])
+    scaled = [(constraint, constraint.constant) for name, constraint in prob.constraints.items()
+              if name.startswith((RESIDUAL_PREFIX, COLLATERAL_PREFIX))]
+    ltvs = []
+    for haircut in haircuts:
+        for constraint, constant in scaled:
+            constraint.constant = constant * (1 - haircut)
+        prob.solve(solver)
+        optimal_Z = value(Z)
+        ltvs.append(1 / optimal_Z if optimal_Z is not None and optimal_Z > 0 else None)
+    return ltvs
+
+
+def sweep_uniform_haircuts(problems, haircuts, solver=None, workers=None, resolve=False, backend="pulp"):
+    """Minimized max LTV per component (rows, numbered as in allocation_table) and haircut (columns).
+
+    A uniform haircut h scales every collateral value by 1 - h. The LP is homogeneous in the
+    allocation, Z and the collateral values, so Opt_Z scales by 1 - h as well and one solve per
+    component gives its whole curve: LTV(h) = LTV(0) / (1 - h). With resolve=True each
+    component's model is instead built once and re-solved per haircut with rescaled collateral
+    right-hand sides (serially, with PuLP; for checking the scaling or non-uniform extensions).
+    """
+    haircuts = list(haircuts)
+    if resolve:
+        curves = [_resolve_haircuts(problem, haircuts, solver) for problem in problems]
+    else:
+        results = solve_component_problems(problems, solver=solver, workers=workers, backend=backend)
+        curves = [[result["Minimized_Max_LTV"] / (1 - haircut)
+                   if result["Minimized_Max_LTV"] is not None and haircut < 1 else None for haircut in haircuts]
+                  for result in results]
+    return pd.DataFrame(curves, index=pd.RangeIndex(1, len(problems) + 1, name="Component"),
+                        columns=pd.Index(haircuts, name="Haircut"), dtype=float)
@@ -0,0 +1,88 @@
+# Persistent cache of component LP solutions, addressed by problem content.
+#
+# Components of the same shape recur across tapes and scenario runs under different loan and
+# asset references, so the key is identifier-free: exposures by lien class, collateral values
+# and links, with loans and assets replaced by their position in the component. Solutions are
+# stored in a SQLite file (safe for concurrent worker processes) and evicted least recently used.
+# The connection runs in autocommit mode and new solutions / last-used touches are buffered and
+# written by flush() in one short transaction, so no worker holds the write lock while solving.
+import hashlib
+import json
+import sqlite3
+import time
+
+
+def canonical_component(problem, namespace=""):
+    """(key, loan positions, asset positions) of a component problem; namespace keeps backends apart."""
+    loans = {loan: pos for pos, loan in enumerate(list(problem["Loans_Lien1"]) + list(problem["Loans_LienGT1"]))}
+    assets = {asset: pos for pos, asset in enumerate(problem["Collaterals"])}
+    links = sorted({(loans[i], assets[j]) for i, j in problem["Links"] if i in loans and j in assets})
+    content = [namespace, list(problem["Loans_Lien1"].values()), list(problem["Loans_LienGT1"].values()),
+               list(problem["Collaterals"].values()), links]
+    return hashlib.sha256(json.dumps(content, default=float).encode()).hexdigest(), loans, assets
+
+
+class ComponentSolutionCache:
+    """On-disk LRU cache of (allocation, Opt_Z, minimized max LTV, status) per component shape."""
+
+    def __init__(self, path, max_entries=100_000, namespace=""):
+        self.path = path
+        self.max_entries = max_entries
+        self.namespace = namespace
+        self.hits = 0
+        self.misses = 0
+        self._touched = []
+        self._pending = []
+        self._db = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self._db.execute("CREATE TABLE IF NOT EXISTS solutions (key TEXT PRIMARY KEY, solution TEXT, last_used INTEGER)")
+
+    def get(self, problem):
+        """Cached solution of problem in lp_allocation_component() form, or None."""
+        key, loans, assets = canonical_component(problem, self.namespace)
+        row = self._db.execute("SELECT solution FROM solutions WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._touched.append((time.time_ns(), key))
+
+        solution = json.loads(row[0])
+        values = {(loan_pos, asset_pos): alloc_value for loan_pos, asset_pos, alloc_value in solution["Allocation"]}
+        allocation = {"Lien1": {i: {} for i in problem["Loans_Lien1"]}, "LienGT1": {i: {} for i in problem["Loans_LienGT1"]}}
+        # Rebuilt in the problem's own link order, as the solver would have reported it
+        for i, j in dict.fromkeys(problem["Links"]):
+            pair = (loans.get(i), assets.get(j))
+            if pair in values:
+                allocation["Lien1" if i in problem["Loans_Lien1"] else "LienGT1"][i][j] = values[pair]
+        return allocation, solution["Opt_Z"], solution["Minimized_Max_LTV"], solution["Status"]
+
+    def put(self, problem, solved):
+        allocation, opt_Z, min_max_LTV, status = solved
+        key, loans, assets = canonical_component(problem, self.namespace)
+        pairs = [[loans[i], assets[j], alloc_value] for lien_type in ("Lien1", "LienGT1")
+                 for i, allocs in allocation[lien_type].items() for j, alloc_value in allocs.items()]
+        solution = {"Allocation": pairs, "Opt_Z": opt_Z, "Minimized_Max_LTV": min_max_LTV, "Status": status}
+        self._pending.append((key, json.dumps(solution, default=float), time.time_ns()))
+
+    def flush(self):
+        """Write buffered solutions and last-used touches in one transaction."""
+        if not self._pending and not self._touched:
+            return
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            self._db.executemany("INSERT OR REPLACE INTO solutions VALUES (?, ?, ?)", self._pending)
+            self._db.executemany("UPDATE solutions SET last_used = ? WHERE key = ?", self._touched)
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self._db.execute("COMMIT")
+        self._pending, self._touched = [], []
+
+    def evict(self):
+        """Drop the least recently used solutions beyond max_entries."""
+        self._db.execute("DELETE FROM solutions WHERE key NOT IN "
+                         "(SELECT key FROM solutions ORDER BY last_used DESC LIMIT ?)", (self.max_entries,))
+
+    def close(self):
+        self.flush()
+        self._db.close()
@@ -0,0 +1,145 @@
+# Prepared portfolio: the preprocessing every LTV method shares, done once per tape, on a
+# compact typed model (integer-coded keys, categorical attributes, float64 amounts).
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from ltv_components import label_components
+from ltv_fallback import build_fallback_table, lien_rank
+from ltv_profile import profiled
+
+DEBT_COL = 'Total outstanding debt as of 29.02.2024'
+GAV_COL = 'Gross Appraisal Value'
+
+KEY_COLS = ['Loan reference', 'Borrower reference', 'Asset ID']
+CATEGORY_COLS = ['Province', 'Collateral type', 'Priority Ranking']
+LIEN_RANK_COL = 'Lien Rank'
+
+
+@dataclass
+class PortfolioCodes:
+    """Original identifiers behind each integer-coded key column (code = position)."""
+    uniques: dict
+
+    def decode(self, col, codes):
+        """Identifiers for an array / Series of codes of col; missing codes decode to NaN."""
+        codes = np.asarray(pd.Series(codes).fillna(-1), dtype=np.intp)
+        return self.uniques[col].take(codes, allow_fill=True, fill_value=np.nan)
+
+
+def _encode_keys(values):
+    codes, uniques = pd.factorize(values)
+    codes = codes.astype(np.int32)
+    # Missing references stay missing (nullable codes), so merges and groupbys treat them as before
+    if (codes < 0).any():
+        return pd.arrays.IntegerArray(codes, mask=codes < 0), uniques
+    return codes, uniques
+
+
+def encode_portfolio(df_loans, df_collateral, debt_col=DEBT_COL, gav_col=GAV_COL):
+    """Integer-coded copies of cleaned loan / collateral frames plus the codes to decode them.
+
+    Loan, borrower and asset references become int32 codes (asset codes come from the distinct
+    (Collateral unit reference, Plot) pairs, so the 'unit__plot' string is built once per asset,
+    not once per row); Province, Collateral type and Priority Ranking become categoricals, the
+    lien is parsed into an int8 'Lien Rank' and amounts are float64.
+    """
+    loan_codes, loans = _encode_keys(pd.concat([df_loans['Loan reference'], df_collateral['Loan reference']],
+                                               ignore_index=True))
+    borrower_codes, borrowers = _encode_keys(df_loans['Borrower reference'])
+
+    pair_codes, _ = pd.MultiIndex.from_frame(df_collateral[['Collateral unit reference', 'Plot']]).factorize()
+    first_rows = df_collateral.iloc[np.unique(pair_codes, return_index=True)[1]]
+    pair_ids = first_rows['Collateral unit reference'].astype(str) + '__' + first_rows['Plot'].astype(str)
+    id_codes, assets = _encode_keys(pair_ids)
+    asset_codes = id_codes[pair_codes]
+
+    n_loans = len(df_loans)
+    loans_coded = df_loans.assign(**{
+        'Loan reference': loan_codes[:n_loans],
+        'Borrower reference': borrower_codes,
+        debt_col: df_loans[debt_col].astype(np.float64)
+    })
+    collateral_coded = df_collateral.drop(columns=['Collateral unit reference', 'Plot', 'Asset ID'], errors='ignore').assign(**{
+        'Loan reference': loan_codes[n_loans:],
+        'Asset ID': asset_codes,
+        gav_col: df_collateral[gav_col].astype(np.float64),
+        **{col: df_collateral[col].astype('category') for col in CATEGORY_COLS},
+        LIEN_RANK_COL: lien_rank(df_collateral['Priority Ranking'])
+    })
+    codes = PortfolioCodes({'Loan reference': loans, 'Borrower reference': borrowers, 'Asset ID': assets})
+    return loans_coded, collateral_coded, codes
+
+
+@dataclass
+class PreparedPortfolio:
+    """Merged links, lien split, aggregates, fallback tables and components of one encoded tape."""
+    df_loans: pd.DataFrame
+    df_collateral: pd.DataFrame
+    df_merged: pd.DataFrame
+    debt_col: str
+    gav_col: str
+    loan_order: dict
+    collateral_is_lien1: pd.Series
+    df_lien1: pd.DataFrame
+    df_lien_gt1: pd.DataFrame
+    lien1_debt_by_asset: pd.Series
+    lien1_allocation: pd.DataFrame
+    lien1_loans: pd.DataFrame
+    fallback_ref: pd.DataFrame
+    allocation_fallback_ref: pd.DataFrame
+    link_labels: object
+    loan_labels: pd.Series
+    asset_labels: pd.Series
+    codes: PortfolioCodes
+
+
+@profiled('prepare')
+def prepare_portfolio(df_loans, df_collateral, debt_col=DEBT_COL, gav_col=GAV_COL):
+    """Build the shared preprocessing from load_clean_data output (or any frames in that shape).
+
+    All frames hold the encode_portfolio() representation: key columns are integer codes and
+    callers decode them with prepared.codes when building their output.
+    lien1_allocation is the per-loan Lien 1 conservative / aggressive allocation behind
+    Method 1 and allocation_fallback_ref its weighted fallback; lien1_loans and fallback_ref
+    are the summed-debt-over-summed-GAV basis used by the borrower and component methods.
+    """
+    df_loans, df_collateral, codes = encode_portfolio(df_loans, df_collateral, debt_col, gav_col)
+    loan_order = {loan_ref: idx for idx, loan_ref in enumerate(df_loans['Loan reference'])}
+    collateral_is_lien1 = df_collateral[LIEN_RANK_COL] == 1
+
+    df_merged = pd.merge(df_collateral, df_loans, on='Loan reference', how='left')
+    merged_is_lien1 = df_merged[LIEN_RANK_COL] == 1
+    df_lien1 = df_merged[merged_is_lien1].copy()
+    df_lien_gt1 = df_merged[~merged_is_lien1].copy()
+
+    # Lien 1 debt per asset and each Lien 1 loan's pro rata share of the asset value
+    lien1_debt_by_asset = df_lien1.groupby('Asset ID')[debt_col].sum().rename('Lien 1 Debt')
+    df_lien1 = df_lien1.merge(lien1_debt_by_asset.reset_index(), on='Asset ID', how='left')
+    df_lien1['Allocated AV Conservative'] = df_lien1[gav_col] * df_lien1[debt_col] / df_lien1['Lien 1 Debt']
+    df_lien1['Allocated AV Aggressive'] = df_lien1[gav_col]
+
+    lien1_allocation = df_lien1.groupby('Loan reference').agg({
+        'Borrower reference': 'first',
+        debt_col: 'first',
+        'Allocated AV Conservative': 'sum',
+        'Allocated AV Aggressive': 'sum'
+    }).reset_index()
+    lien1_allocation['Conservative LTV (%)'] = lien1_allocation[debt_col] / lien1_allocation['Allocated AV Conservative'] * 100
+    lien1_allocation['Aggressive LTV (%)'] = lien1_allocation[debt_col] / lien1_allocation['Allocated AV Aggressive'] * 100
+    lien1_allocation['Used Fallback'] = False
+    allocation_fallback_ref = build_fallback_table(lien1_allocation, df_merged, 'Conservative LTV (%)', debt_col)
+
+    lien1_loans = df_lien1.groupby('Loan reference').agg({gav_col: 'sum', debt_col: 'sum'}).reset_index()
+    lien1_loans['Conservative LTV (%)'] = lien1_loans[debt_col] / lien1_loans[gav_col] * 100
+    fallback_ref = build_fallback_table(lien1_loans, df_collateral, 'Conservative LTV (%)', debt_col)
+
+    link_labels, loan_labels, asset_labels = label_components(df_merged['Loan reference'], df_merged['Asset ID'])
+
+    return PreparedPortfolio(
+        df_loans=df_loans, df_collateral=df_collateral, df_merged=df_merged, debt_col=debt_col, gav_col=gav_col,
+        loan_order=loan_order, collateral_is_lien1=collateral_is_lien1, df_lien1=df_lien1, df_lien_gt1=df_lien_gt1,
+        lien1_debt_by_asset=lien1_debt_by_asset, lien1_allocation=lien1_allocation, lien1_loans=lien1_loans,
+        fallback_ref=fallback_ref, allocation_fallback_ref=allocation_fallback_ref,
+        link_labels=link_labels, loan_labels=loan_labels, asset_labels=asset_labels, codes=codes)
@@ -0,0 +1,149 @@
+# Opt-in per-stage instrumentation: elapsed time, peak memory growth and counts per span.
+#
+#   with profiling('run_profile.json', cprofile_stage='lp.solve'):
+#       result = calculate_lp_based_ltv(df_loans, df_collateral)   # spans 'lp', 'lp.build', 'lp.solve'
+#
+# Spans nest ('lp/lp.solve'); each records its wall time, how far the process's peak RSS rose
+# while it ran and any counts passed to it. Outside profiling() span() hands back a shared
+# no-op object, so instrumented code pays one global lookup per span and nothing else.
+# The interactive scripts profile a run when the LTV_PROFILE environment variable names the
+# JSON file (and LTV_CPROFILE_STAGE the span to run under cProfile).
+import cProfile
+import json
+import os
+import resource
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from functools import wraps
+
+PROFILE_ENV = 'LTV_PROFILE'
+CPROFILE_ENV = 'LTV_CPROFILE_STAGE'
+
+_profile = None  # the RunProfile of the enclosing profiling() block, if any
+
+
+def _peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20) if sys.platform == 'darwin' else peak / 1024  # bytes on macOS, KiB elsewhere
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def count(self, **counts):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    def __init__(self, profile, name, counts):
+        self.profile = profile
+        self.name = name
+        self.counts = counts
+
+    def count(self, **counts):
+        """Attach row / component counts to the span."""
+        self.counts.update(counts)
+
+    def __enter__(self):
+        profile = self.profile
+        profile.stack.append(self)
+        self.cprofile = profile.cprofile if self.name == profile.cprofile_stage and not profile.cprofiling else None
+        if self.cprofile is not None:
+            profile.cprofiling = True
+            self.cprofile.enable()
+        self.start_rss = _peak_rss_mb()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        if self.cprofile is not None:
+            self.cprofile.disable()
+            self.profile.cprofiling = False
+        peak_rss = _peak_rss_mb()
+        profile = self.profile
+        path = '/'.join(span.name for span in profile.stack)
+        profile.stack.pop()
+        profile.spans.append({'span': path, 'seconds': seconds, 'peak_rss_delta_mb': peak_rss - self.start_rss,
+                              'peak_rss_mb': peak_rss, **self.counts})
+        return False
+
+
+class RunProfile:
+    """Spans recorded during one profiling() block, in the order they finished."""
+
+    def __init__(self, cprofile_stage=None):
+        self.cprofile_stage = cprofile_stage
+        self.cprofile = cProfile.Profile() if cprofile_stage else None
+        self.cprofiling = False
+        self.stack = []
+        self.spans = []
+        self.started = datetime.now(timezone.utc).isoformat(timespec='seconds')
+        self.start = time.perf_counter()
+
+    def write(self, path):
+        """Write the profile as JSON; the cProfile stats, if any, go next to it as <name>.<stage>.prof."""
+        cprofile_path = None
+        if self.cprofile is not None:
+            cprofile_path = f'{os.path.splitext(path)[0]}.{self.cprofile_stage}.prof'
+            self.cprofile.dump_stats(cprofile_path)
+        report = {'started': self.started, 'seconds': time.perf_counter() - self.start,
+                  'peak_rss_mb': _peak_rss_mb(), 'cprofile': cprofile_path, 'spans': self.spans}
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2, default=float)
+
+
+def span(name, **counts):
+    """Context manager timing one stage of the active profile (a no-op when not profiling)."""
+    if _profile is None:
+        return _NULL_SPAN
+    return _Span(_profile, name, counts)
+
+
+def profiled(name):
+    """Decorator running the function in span(name), counting the rows of a frame or list it returns."""
+    def decorate(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if _profile is None:
+                return func(*args, **kwargs)
+            with span(name) as stage:
+                result = func(*args, **kwargs)
+                if isinstance(result, list) or hasattr(result, 'shape'):
+                    stage.count(rows=len(result))
+                return result
+        return wrapper
+    return decorate
+
+
+@contextmanager
+def profiling(path=None, cprofile_stage=None):
+    """Record spans while the block runs and write them to path as JSON; no path, no profiling.
+
+    With cprofile_stage, every span of that name also runs under cProfile.
+    """
+    global _profile
+    if not path:
+        yield None
+        return
+    profile, previous = RunProfile(cprofile_stage), _profile
+    _profile = profile
+    try:
+        yield profile
+    finally:
+        _profile = previous
+        profile.write(path)
+
+
+def env_profiling():
+    """profiling() configured from the LTV_PROFILE / LTV_CPROFILE_STAGE environment variables."""
+    return profiling(os.environ.get(PROFILE_ENV), os.environ.get(CPROFILE_ENV))
@@ -0,0 +1,236 @@
+# Stress scenarios: loan-level and component LTVs under many appraisal-value haircuts at once.
+#
+# A haircut matrix has one row per scenario and one column per (Province, Collateral type); each
+# collateral row's Gross Appraisal Value is cut by its cell's haircut (cells not in the matrix
+# are not cut). Everything that does not depend on appraisal values - debts, lien split, links,
+# components, which rows fall back - comes from the prepared portfolio once; what does is
+# recomputed for a block of scenarios at a time as rows x scenarios arrays, so memory stays
+# linear in scenarios x loans.
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from ltv_components import aggregate_components
+from ltv_fallback import FALLBACK_KEYS, estimate_gt1_lien1_debt
+from ltv_portfolio import LIEN_RANK_COL
+
+
+@dataclass
+class ScenarioResults:
+    """LTV (%) per scenario (columns): Method 1 loan-level conservative / aggressive LTVs and
+    component LTVs. Method 1 itself reports its loan-level figures as ratios, not percentages."""
+    loan_conservative: pd.DataFrame
+    loan_aggressive: pd.DataFrame
+    component_ltv: pd.DataFrame
+
+
+def load_haircuts(path):
+    """Haircut matrix from a long CSV / Excel table: Scenario, Province, Collateral type, Haircut."""
+    df = pd.read_excel(path) if path.endswith(('.xlsx', '.xls')) else pd.read_csv(path)
+    return df.pivot_table(index='Scenario', columns=FALLBACK_KEYS, values='Haircut', aggfunc='first', sort=False)
+
+
+def _codes(values):
+    """Integer codes as an intp array, missing codes as -1."""
+    return np.asarray(pd.Series(values).fillna(-1), dtype=np.intp)
+
+
+def _group_sum(values, codes, n_groups):
+    """Per-group column sums of a rows x scenarios array; NaN propagates, code -1 is skipped."""
+    keep = codes >= 0
+    codes, values = codes[keep], values[keep]
+    out = np.zeros((n_groups, values.shape[1]))
+    if len(codes):
+        order = np.argsort(codes, kind='stable')
+        groups, starts = np.unique(codes[order], return_index=True)
+        out[groups] = np.add.reduceat(values[order], starts, axis=0)
+    return out
+
+
+def _nan_to_zero(values):
+    # pandas group sums skip NaN
+    return np.where(np.isnan(values), 0.0, values)
+
+
+def _key_positions(frame, index):
+    """Position of each row's (Province, Collateral type) in a MultiIndex, -1 if absent or missing."""
+    keys = frame[FALLBACK_KEYS]
+    pos = index.get_indexer(pd.MultiIndex.from_frame(keys.astype(object)))
+    pos[keys.isna().any(axis=1).to_numpy()] = -1
+    return pos
+
+
+def _fallback_ltv(loan_ltv, loan_weight, pair_loans, pair_keys, n_keys):
+    """build_fallback_table() for every scenario: debt-weighted Lien 1 LTV per fallback key."""
+    weighted = _nan_to_zero(loan_ltv[pair_loans] * loan_weight[pair_loans, None])
+    numerator = _group_sum(weighted, pair_keys, n_keys)
+    denominator = _group_sum(_nan_to_zero(loan_weight[pair_loans, None]), pair_keys, n_keys)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return numerator / denominator
+
+
+def _fallback_pairs(loans, frame, fallback_ref):
+    """(loan position, fallback key position) for each distinct (loan, Province, Collateral type) link."""
+    pairs = frame[['Loan reference'] + FALLBACK_KEYS].drop_duplicates()
+    pair_loans = pd.Index(loans).get_indexer(pairs['Loan reference'])
+    pair_keys = _key_positions(pairs, pd.MultiIndex.from_frame(fallback_ref[FALLBACK_KEYS]))
+    keep = (pair_loans >= 0) & (pair_keys >= 0)
+    return pair_loans[keep], pair_keys[keep]
+
+
+class ScenarioModel:
+    """Value-independent part of a prepared portfolio, evaluated for blocks of haircut vectors.
+
+    cells are the (Province, Collateral type) pairs present on the tape; evaluate() takes a
+    scenarios x cells haircut array and returns Method 1 conservative / aggressive LTVs per
+    loan (loan_index) and component LTVs (component_index), each as an items x scenarios array.
+    """
+
+    def __init__(self, prepared):
+        debt_col, gav_col = prepared.debt_col, prepared.gav_col
+        df_lien1, df_lien_gt1, df_merged = prepared.df_lien1, prepared.df_lien_gt1, prepared.df_merged
+        self.cells = pd.MultiIndex.from_frame(df_merged[FALLBACK_KEYS].dropna().drop_duplicates().astype(object))
+        self.n_loan_codes = n_loan_codes = len(prepared.codes.uniques['Loan reference'])
+
+        self.lien1_cells, self.gt1_cells, self.merged_cells = (
+            _key_positions(frame, self.cells) for frame in (df_lien1, df_lien_gt1, df_merged))
+        self.lien1_rows, self.gt1_rows = _codes(df_lien1['Loan reference']), _codes(df_lien_gt1['Loan reference'])
+        self.lien1_gav, self.gt1_gav = df_lien1[gav_col].to_numpy(dtype=float), df_lien_gt1[gav_col].to_numpy(dtype=float)
+        self.lien1_share = (df_lien1[debt_col] / df_lien1['Lien 1 Debt']).to_numpy(dtype=float)
+
+        # Method 1: Lien 1 loans, their allocation fallback table and the Lien >1 loans' estimate
+        self.lien1_loans = lien1_loans = _codes(prepared.lien1_allocation['Loan reference'])
+        self.lien1_debt = lien1_debt = prepared.lien1_allocation[debt_col].to_numpy(dtype=float)
+        self.alloc_pairs = _fallback_pairs(lien1_loans, df_merged, prepared.allocation_fallback_ref)
+        self.n_alloc_keys = len(prepared.allocation_fallback_ref)
+
+        no_fallback = prepared.allocation_fallback_ref.iloc[:0]
+        gt1_base = estimate_gt1_lien1_debt(df_lien_gt1, df_lien1, no_fallback, debt_col, gav_col)
+        self.gt1_lien1_debt = gt1_base['Estimated Lien 1 Debt'].to_numpy(dtype=float)
+        self.gt1_loans = gt1_loans = _codes(gt1_base.index)
+        gt1_first = df_lien_gt1.drop_duplicates('Loan reference').set_index('Loan reference')[debt_col]
+        gt1_debt = gt1_first.reindex(gt1_base.index).to_numpy(dtype=float)
+        self.uncovered = ~df_lien_gt1['Asset ID'].isin(df_lien1['Asset ID']).to_numpy()
+        self.gt1_alloc_keys = np.where(self.uncovered, _key_positions(df_lien_gt1, pd.MultiIndex.from_frame(
+            prepared.allocation_fallback_ref[FALLBACK_KEYS])), -1)
+
+        # Output loans: every Lien 1 or Lien >1 loan, in loan tape order
+        loan_order = prepared.loan_order
+        output_loans = pd.Index(np.union1d(lien1_loans[lien1_loans >= 0], gt1_loans[gt1_loans >= 0]))
+        output_loans = output_loans[np.argsort([loan_order.get(loan, len(loan_order)) for loan in output_loans], kind='stable')]
+        self.out_lien1 = output_loans.get_indexer(lien1_loans)
+        self.out_gt1 = output_loans.get_indexer(gt1_loans)
+        self.output_debt = np.full(len(output_loans), np.nan)
+        self.output_debt[self.out_gt1] = gt1_debt
+        self.output_debt[self.out_lien1] = lien1_debt
+        self.loan_index = pd.Index(prepared.codes.decode('Loan reference', output_loans), name='Loan reference')
+        self.loan_components = prepared.loan_labels.reindex(output_loans).to_numpy()
+
+        # Component method: debts and fallback rows do not depend on appraisal values
+        link_labels = np.asarray(prepared.link_labels)
+        components = aggregate_components(df_merged, link_labels, debt_col, gav_col)
+        self.component_index = components.index
+        self.n_components = len(components)
+        self.component_lien1_debt = components['Total Lien 1 Debt'].to_numpy()
+        self.component_gt1_debt = components['Total Lien > 1 Debt'].to_numpy()
+        component_rows = df_merged.assign(Component=link_labels).drop_duplicates(['Component', 'Asset ID', gav_col] + FALLBACK_KEYS)
+        self.component_row_cells = _key_positions(component_rows, self.cells)
+        self.component_row_gav = component_rows[gav_col].to_numpy(dtype=float)
+        self.component_rows = component_rows['Component'].to_numpy()
+        merged_lien1 = (df_merged[LIEN_RANK_COL] == 1).to_numpy()
+        comp_uncovered = ~merged_lien1 & ~df_merged['Asset ID'].isin(df_merged.loc[merged_lien1, 'Asset ID']).to_numpy()
+        self.comp_uncovered_rows = np.where(comp_uncovered, link_labels, -1)
+        self.comp_fallback_keys = np.where(comp_uncovered, _key_positions(df_merged, pd.MultiIndex.from_frame(
+            prepared.fallback_ref[FALLBACK_KEYS])), -1)
+        self.merged_gav = df_merged[gav_col].to_numpy(dtype=float)
+        self.lien1_loan_debt = _group_sum(_nan_to_zero(df_lien1[[debt_col]].to_numpy(dtype=float)),
+                                          self.lien1_rows, n_loan_codes)[:, 0]
+        self.loan_pairs = _fallback_pairs(np.arange(n_loan_codes), prepared.df_collateral, prepared.fallback_ref)
+        self.n_comp_keys = len(prepared.fallback_ref)
+        self.has_lien1 = np.zeros(n_loan_codes, dtype=bool)
+        self.has_lien1[self.lien1_rows[self.lien1_rows >= 0]] = True
+
+    def haircut_matrix(self, haircuts):
+        """scenarios x cells array of a haircut DataFrame; cells it does not name are not cut."""
+        columns = pd.MultiIndex.from_tuples(list(haircuts.columns))
+        return haircuts.set_axis(columns, axis=1).reindex(columns=self.cells).fillna(0).to_numpy(dtype=float)
+
+    def evaluate(self, block):
+        """(conservative, aggressive, component) LTV (%) arrays for a scenarios x cells haircut block."""
+        block = np.hstack([block, np.zeros((len(block), 1))])  # rows without a cell are not cut
+        n_loan_codes, lien1_loans = self.n_loan_codes, self.lien1_loans
+
+        def cut(gav, row_cells):
+            return gav[:, None] * (1 - block[:, row_cells].T)
+
+        # Method 1, Lien 1 loans: pro rata conservative allocation and full aggressive value
+        lien1_cut = cut(self.lien1_gav, self.lien1_cells)
+        alloc_cons = _group_sum(_nan_to_zero(lien1_cut * self.lien1_share[:, None]), self.lien1_rows, n_loan_codes)
+        alloc_aggr = _group_sum(_nan_to_zero(lien1_cut), self.lien1_rows, n_loan_codes)
+        ltv_by_loan = np.full((n_loan_codes, len(block)), np.nan)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ltv_by_loan[lien1_loans] = self.lien1_debt[:, None] / alloc_cons[lien1_loans] * 100
+        alloc_fallback = _fallback_ltv(ltv_by_loan, _loan_values(lien1_loans, self.lien1_debt, n_loan_codes),
+                                       lien1_loans[self.alloc_pairs[0]], self.alloc_pairs[1], self.n_alloc_keys)
+
+        # Method 1, Lien >1 loans: value left after the (estimated) Lien 1 debt
+        gt1_cut = cut(self.gt1_gav, self.gt1_cells)
+        fallback_debt = np.where((self.gt1_alloc_keys >= 0)[:, None],
+                                 alloc_fallback[self.gt1_alloc_keys] / 100 * gt1_cut, 0.0)
+        estimated = (self.gt1_lien1_debt[:, None] +
+                     _group_sum(np.where(self.uncovered[:, None], fallback_debt, 0.0), self.gt1_rows, n_loan_codes)[self.gt1_loans])
+        total_av = _group_sum(_nan_to_zero(gt1_cut), self.gt1_rows, n_loan_codes)[self.gt1_loans]
+        gt1_cons = np.where(total_av > estimated, total_av - estimated, 0) + alloc_cons[self.gt1_loans]
+
+        # Loans with both lien classes sum their two rows, as Method 1's final groupby does
+        loan_cons = np.zeros((len(self.output_debt), len(block)))
+        loan_aggr = np.zeros((len(self.output_debt), len(block)))
+        loan_cons[self.out_lien1] += _nan_to_zero(alloc_cons[lien1_loans])
+        loan_aggr[self.out_lien1] += _nan_to_zero(alloc_aggr[lien1_loans])
+        loan_cons[self.out_gt1] += _nan_to_zero(gt1_cons)
+        loan_aggr[self.out_gt1] += _nan_to_zero(total_av)
+
+        # Component method: fallback table from summed Lien 1 debt over summed Lien 1 value
+        with np.errstate(divide='ignore', invalid='ignore'):
+            conservative = self.output_debt[:, None] / loan_cons * 100
+            aggressive = self.output_debt[:, None] / loan_aggr * 100
+            loan_ltv = self.lien1_loan_debt[:, None] / alloc_aggr * 100
+        loan_ltv[~self.has_lien1] = np.nan
+        comp_fallback = _fallback_ltv(loan_ltv, np.where(self.has_lien1, self.lien1_loan_debt, np.nan),
+                                      *self.loan_pairs, self.n_comp_keys)
+        merged_cut = cut(self.merged_gav, self.merged_cells)
+        comp_fallback_debt = np.where((self.comp_fallback_keys >= 0)[:, None],
+                                      comp_fallback[self.comp_fallback_keys] / 100 * merged_cut, 0.0)
+        total_lien1 = self.component_lien1_debt[:, None] + _group_sum(comp_fallback_debt, self.comp_uncovered_rows,
+                                                                      self.n_components)
+        total_gav = _group_sum(_nan_to_zero(cut(self.component_row_gav, self.component_row_cells)),
+                               self.component_rows, self.n_components)
+        total_debt = total_lien1 + self.component_gt1_debt[:, None]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            component = np.where(total_gav != 0, total_debt / total_gav * 100, 0)
+        return conservative, aggressive, component
+
+
+def run_stress_scenarios(prepared, haircuts, chunk_size=32):
+    """Loan and component LTVs of a prepared portfolio for every scenario in haircuts.
+
+    haircuts is a DataFrame indexed by scenario with (Province, Collateral type) MultiIndex
+    columns, holding the fractional fall in appraisal value (0.2 = 20% decline; missing = none).
+    Figures are those Method 1 and the component method give when rerun on the cut values.
+    """
+    model = ScenarioModel(prepared)
+    cell_haircuts = model.haircut_matrix(haircuts)
+    blocks = [model.evaluate(cell_haircuts[start:start + chunk_size])
+              for start in range(0, len(haircuts), chunk_size) or [0]]
+    conservative, aggressive, component = (np.hstack(parts) for parts in zip(*blocks))
+    return ScenarioResults(
+        loan_conservative=pd.DataFrame(conservative, index=model.loan_index, columns=haircuts.index),
+        loan_aggressive=pd.DataFrame(aggressive, index=model.loan_index, columns=haircuts.index),
+        component_ltv=pd.DataFrame(component, index=model.component_index, columns=haircuts.index))
+
+
+def _loan_values(loans, values, n_loan_codes):
+    out = np.full(n_loan_codes, np.nan)
+    out[loans] = values
+    return out
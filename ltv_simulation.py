@@ -0,0 +1,119 @@
+# Monte Carlo LTV distributions under correlated appraisal-value shocks.
+#
+# Each path draws one log-normal value shock per (Province, Collateral type) from a factor model
+# (market + province + collateral type + cell specific), applies it as a haircut and re-evaluates
+# Method 1 loan LTVs and component LTVs with the ScenarioModel of ltv_scenarios. Paths are drawn
+# and evaluated in chunks, each chunk with its own child seed so results do not depend on the
+# number of worker processes; per-path results go to float32 memory-mapped files on disk and the
+# percentiles are taken block by block, so memory is bounded by the chunk and block sizes.
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from ltv_scenarios import ScenarioModel
+
+
+@dataclass
+class SimulationResults:
+    """LTV (%) percentiles (columns 'P5', 'P50', ...) over n_paths simulated paths.
+
+    loan_conservative is Method 1's conservative LTV per loan, loan_component the LTV of each
+    loan's component (with its 'Component' label) and component_ltv the same per component.
+    """
+    loan_conservative: pd.DataFrame
+    loan_component: pd.DataFrame
+    component_ltv: pd.DataFrame
+    n_paths: int
+
+
+def draw_haircuts(cells, n_paths, rng, volatility=0.10, market_corr=0.5, province_corr=0.2, type_corr=0.1):
+    """n_paths x cells haircuts from mean-one log-normal value shocks with factor correlation.
+
+    Two cells' log shocks correlate by market_corr, plus province_corr when they share a
+    Province and type_corr when they share a Collateral type.
+    """
+    idiosyncratic = 1 - market_corr - province_corr - type_corr
+    if min(market_corr, province_corr, type_corr, idiosyncratic) < 0:
+        raise ValueError("Correlations must be non-negative and sum to at most 1")
+    province_codes, provinces = pd.factorize(cells.get_level_values(0))
+    type_codes, types = pd.factorize(cells.get_level_values(1))
+
+    z = (np.sqrt(market_corr) * rng.standard_normal((n_paths, 1)) +
+         np.sqrt(province_corr) * rng.standard_normal((n_paths, len(provinces)))[:, province_codes] +
+         np.sqrt(type_corr) * rng.standard_normal((n_paths, len(types)))[:, type_codes] +
+         np.sqrt(idiosyncratic) * rng.standard_normal((n_paths, len(cells))))
+    return 1 - np.exp(volatility * z - volatility ** 2 / 2)
+
+
+_worker_model = None
+
+
+def _init_worker(model):
+    global _worker_model
+    _worker_model = model
+
+
+def _simulate_chunk(start, n_paths, seed, shock_params, paths_files, total_paths, model=None):
+    """Draw and evaluate paths [start, start + n_paths) and write them to the path files."""
+    model = model or _worker_model
+    haircuts = draw_haircuts(model.cells, n_paths, np.random.default_rng(seed), **shock_params)
+    conservative, _, component = model.evaluate(haircuts)
+    for path, values in zip(paths_files, (conservative, component)):
+        out = np.memmap(path, dtype=np.float32, mode='r+', shape=(total_paths, len(values)))
+        out[start:start + n_paths] = values.T
+        out.flush()
+    return n_paths
+
+
+def _percentiles(path, shape, percentiles, index, block_bytes=1 << 28):
+    """Percentiles over paths of every column of a paths x items memory-mapped file."""
+    values = np.memmap(path, dtype=np.float32, mode='r', shape=shape)
+    width = max(1, block_bytes // (4 * max(shape[0], 1)))
+    parts = [np.percentile(values[:, start:start + width], percentiles, axis=0).T
+             for start in range(0, shape[1], width)]
+    table = np.vstack(parts) if parts else np.empty((0, len(percentiles)))
+    return pd.DataFrame(table, index=index, columns=[f'P{q:g}' for q in percentiles])
+
+
+def simulate_ltv_distribution(prepared, n_paths=1000, percentiles=(5, 50, 95), seed=0, chunk_size=50,
+                              workers=None, work_dir=None, **shock_params):
+    """Monte Carlo percentiles of loan and component LTVs for a prepared portfolio.
+
+    shock_params go to draw_haircuts(). The same seed and chunk_size give the same paths
+    whatever the number of workers. Per-path results are kept in a temporary directory (or
+    work_dir), about 4 bytes x paths x (loans + components).
+    """
+    model = ScenarioModel(prepared)
+    n_loans, n_components = len(model.loan_index), model.n_components
+    starts = list(range(0, n_paths, chunk_size))
+    seeds = np.random.SeedSequence(seed).spawn(len(starts))
+
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmp_dir:
+        paths_files = [os.path.join(tmp_dir, 'loan_conservative.f32'), os.path.join(tmp_dir, 'component.f32')]
+        for path, n_items in zip(paths_files, (n_loans, n_components)):
+            np.memmap(path, dtype=np.float32, mode='w+', shape=(n_paths, n_items)).flush()
+
+        chunks = [(start, min(chunk_size, n_paths - start), chunk_seed, shock_params, paths_files, n_paths)
+                  for start, chunk_seed in zip(starts, seeds)]
+        done = 0
+        if not workers or workers <= 1:
+            for chunk in chunks:
+                done += _simulate_chunk(*chunk, model=model)
+                print(f"Simulated {done}/{n_paths} paths")
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(model,)) as executor:
+                for future in as_completed([executor.submit(_simulate_chunk, *chunk) for chunk in chunks]):
+                    done += future.result()
+                    print(f"Simulated {done}/{n_paths} paths")
+
+        loan_conservative = _percentiles(paths_files[0], (n_paths, n_loans), percentiles, model.loan_index)
+        component_ltv = _percentiles(paths_files[1], (n_paths, n_components), percentiles, model.component_index)
+
+    loan_component = component_ltv.reindex(model.loan_components).set_axis(model.loan_index)
+    loan_component.insert(0, 'Component', model.loan_components)
+    return SimulationResults(loan_conservative=loan_conservative, loan_component=loan_component,
+                             component_ltv=component_ltv, n_paths=n_paths)
@@ -0,0 +1,87 @@
+# Multi-lien waterfall: value available to every loan-asset link under any number of charge levels.
+#
+# Each link carries a claim, its loan's debt split over the loan's links by appraisal value. On
+# every asset the links are sorted by integer Lien Rank (unparsed ranks last) and the claims of
+# the more senior ranks are accumulated with grouped cumulative sums; the value left after them
+# is shared pro rata between the links of the same rank (conservative) or left whole to each of
+# them (aggressive). Assets with no Lien 1 link carry the fallback Lien 1 estimate ahead of
+# every rank, as in the Lien 1 / Lien >1 methods.
+import numpy as np
+import pandas as pd
+
+from ltv_fallback import apply_fallback
+from ltv_portfolio import LIEN_RANK_COL
+
+# Seniority given to links whose Priority Ranking did not parse: behind every real rank
+UNRANKED_SENIORITY = np.iinfo(np.int16).max
+
+
+def link_claims(loan_keys, gav, debt):
+    """Each link's share of its loan's debt, split over the loan's links by appraisal value.
+
+    Loans whose links carry no value split their debt equally instead.
+    """
+    gav = pd.Series(np.asarray(gav, dtype=float), index=loan_keys.index)
+    loan_gav = gav.groupby(loan_keys).transform('sum').to_numpy()
+    loan_links = gav.groupby(loan_keys).transform('size').to_numpy()
+    share = np.where(loan_gav > 0, gav.to_numpy() / np.where(loan_gav > 0, loan_gav, 1), 1 / loan_links)
+    return np.asarray(debt, dtype=float) * share
+
+
+def lien_waterfall(prepared, use_fallback=True):
+    """One row per link of prepared.df_merged (same order) with its place in the asset's waterfall.
+
+    Columns: Loan reference / Asset ID (codes), Lien Rank, Claim, Senior Claim (claims of the more
+    senior ranks plus any fallback Lien 1 estimate), Available Value (appraisal value left after
+    them), Allocated AV Conservative / Aggressive and Used Fallback.
+    """
+    df = prepared.df_merged
+    gav = df[prepared.gav_col].to_numpy(dtype=float)
+    rank = df[LIEN_RANK_COL].to_numpy()
+    seniority = np.where(rank > 0, rank, UNRANKED_SENIORITY).astype(np.int16)
+    claim = link_claims(df['Loan reference'], gav, df[prepared.debt_col])
+
+    # (asset, rank) groups in seniority order; the senior claim of a group is the running
+    # total of the groups before it on the same asset
+    order = np.lexsort((seniority, df['Asset ID'].to_numpy()))
+    asset_sorted, seniority_sorted = df['Asset ID'].to_numpy()[order], seniority[order]
+    new_group = np.r_[True, (asset_sorted[1:] != asset_sorted[:-1]) | (seniority_sorted[1:] != seniority_sorted[:-1])]
+    group_of_link = np.empty(len(df), dtype=np.intp)
+    group_of_link[order] = np.cumsum(new_group) - 1
+    groups = pd.DataFrame({
+        'Asset ID': asset_sorted[new_group],
+        'Seniority': seniority_sorted[new_group],
+        'Claim': np.bincount(group_of_link, weights=claim, minlength=int(new_group.sum())),
+        'Links': np.bincount(group_of_link, minlength=int(new_group.sum()))
+    })
+    groups['Senior Claim'] = groups.groupby('Asset ID')['Claim'].cumsum() - groups['Claim']
+
+    used_fallback = np.zeros(len(df), dtype=bool)
+    if use_fallback:
+        # Assets whose most senior charge is not Lien 1 get the fallback estimate ahead of everything
+        fallback = apply_fallback(df, prepared.fallback_ref, prepared.gav_col)
+        first_link = pd.Series(np.arange(len(df))).groupby(df['Asset ID'].to_numpy()).first()
+        asset_fallback = pd.Series(fallback['Fallback Lien 1 Debt'].to_numpy()[first_link.to_numpy()], index=first_link.index)
+        asset_matched = pd.Series(fallback['Fallback Matched'].to_numpy()[first_link.to_numpy()], index=first_link.index)
+        no_lien1 = groups.groupby('Asset ID')['Seniority'].transform('min') > 1
+        groups['Senior Claim'] += np.where(no_lien1, groups['Asset ID'].map(asset_fallback), 0.0)
+        used_fallback = (no_lien1 & groups['Asset ID'].map(asset_matched).astype(bool)).to_numpy()[group_of_link]
+
+    senior_claim = groups['Senior Claim'].to_numpy()[group_of_link]
+    group_claim = groups['Claim'].to_numpy()[group_of_link]
+    group_links = groups['Links'].to_numpy()[group_of_link]
+    available = np.clip(gav - senior_claim, 0, None)
+    pro_rata = np.where(group_claim > 0, claim / np.where(group_claim > 0, group_claim, 1), 1 / group_links)
+
+    return pd.DataFrame({
+        'Loan reference': df['Loan reference'].to_numpy(),
+        'Asset ID': df['Asset ID'].to_numpy(),
+        LIEN_RANK_COL: rank,
+        prepared.gav_col: gav,
+        'Claim': claim,
+        'Senior Claim': senior_claim,
+        'Available Value': available,
+        'Allocated AV Conservative': available * pro_rata,
+        'Allocated AV Aggressive': available,
+        'Used Fallback': used_fallback
+    }, index=df.index)
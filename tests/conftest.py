@@ -0,0 +1,6 @@
+# The modules are flat scripts at the repository root; the synthetic tapes live with the benchmarks
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'benchmarks')]
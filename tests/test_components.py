@@ -0,0 +1,36 @@
+import numpy as np
+import pandas as pd
+
+from ltv_components import aggregate_components
+from ltv_portfolio import LIEN_RANK_COL, prepare_portfolio
+from synthetic_tape import DEBT_COL, make_clean_portfolio
+
+GAV_COL = 'Gross Appraisal Value'
+
+
+def test_lien_classes_follow_parsed_lien_rank():
+    links = pd.DataFrame({
+        'Loan reference': ['L1', 'L2', 'L3', 'L4'],
+        'Asset ID': ['A1', 'A1', 'A2', 'A2'],
+        'Priority Ranking': ['Lien 1', 'Lien 2', 'lien 1', 'Lien 1 '],
+        DEBT_COL: [100.0, 50.0, 30.0, 20.0],
+        GAV_COL: [400.0, 400.0, 200.0, 200.0]
+    })
+    components = aggregate_components(links, np.array([0, 0, 1, 1]), DEBT_COL, GAV_COL)
+
+    # Only the exact 'Lien 1' parses to rank 1, as in prepare_portfolio
+    assert components['Total Lien 1 Debt'].tolist() == [100.0, 0.0]
+    assert components['Total Lien > 1 Debt'].tolist() == [50.0, 50.0]
+
+
+def test_lien_classes_match_prepared_portfolio():
+    df_loans, df_collateral = make_clean_portfolio(400, seed=2)
+    df_collateral['Priority Ranking'] = df_collateral['Priority Ranking'].replace({'Lien 2': 'lien 1'})
+    prepared = prepare_portfolio(df_loans, df_collateral)
+    components = aggregate_components(prepared.df_merged, prepared.link_labels, prepared.debt_col, prepared.gav_col)
+
+    merged = prepared.df_merged
+    lien1 = merged[merged[LIEN_RANK_COL] == 1].drop_duplicates('Loan reference')
+    expected = lien1.groupby(prepared.link_labels[lien1.index])[prepared.debt_col].sum()
+    pd.testing.assert_series_equal(components['Total Lien 1 Debt'].loc[expected.index], expected,
+                                   check_names=False, check_index_type=False)
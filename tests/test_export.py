@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import ltv_export
+from ltv_export import read_split_sheet, write_result
+
+
+@pytest.fixture(params=['openpyxl', 'xlsxwriter'])
+def xlsx_writer(request, monkeypatch):
+    """Run a test once per xlsx writer; xlsxwriter only when it is installed."""
+    if request.param == 'xlsxwriter':
+        monkeypatch.setattr(ltv_export, 'xlsxwriter', pytest.importorskip('xlsxwriter'))
+    else:
+        monkeypatch.setattr(ltv_export, 'xlsxwriter', None)
+    return request.param
+
+
+def result_frame():
+    return pd.DataFrame({
+        'Loan reference': ['L1', 'L2', 'L3', 'L4'],
+        'Conservative LTV (%)': [55.0, np.inf, -np.inf, np.nan],
+        'Mixed': ['a', np.inf, 1.5, None],
+        'Rows': [1, 2, 3, 4]
+    })
+
+
+def test_xlsx_round_trip_matches_pandas(tmp_path, xlsx_writer):
+    df = result_frame()
+    write_result(df, str(tmp_path / 'streamed.xlsx'))
+    df.to_excel(tmp_path / 'pandas.xlsx', index=False)
+
+    streamed = pd.read_excel(tmp_path / 'streamed.xlsx')
+    pd.testing.assert_frame_equal(streamed, pd.read_excel(tmp_path / 'pandas.xlsx'))
+    assert list(streamed['Conservative LTV (%)'].iloc[1:3]) == [np.inf, -np.inf]
+    assert pd.isna(streamed['Conservative LTV (%)'].iloc[3])
+
+
+def test_xlsx_split_sheet_round_trip(tmp_path, xlsx_writer):
+    df = result_frame()
+    path = str(tmp_path / 'split.xlsx')
+    write_result({'Allocations': df}, path, max_rows=3)
+    df.to_excel(tmp_path / 'pandas.xlsx', index=False)
+
+    assert pd.ExcelFile(path).sheet_names == ['Allocations', 'Allocations (2)']
+    pd.testing.assert_frame_equal(read_split_sheet(path, 'Allocations'), pd.read_excel(tmp_path / 'pandas.xlsx'))
+
+
+def test_csv_keeps_pandas_format(tmp_path):
+    df = result_frame().drop(columns='Mixed').assign(**{'Used Fallback': [True, False, True, False],
+                                  'Valuation date': pd.to_datetime(['2020-01-01'] * 4)})
+    written = write_result({'Loans': df, 'Totals': df.head(1)}, str(tmp_path / 'result.csv'))
+
+    assert written == [str(tmp_path / 'result.Loans.csv'), str(tmp_path / 'result.Totals.csv')]
+    df.to_csv(tmp_path / 'pandas.csv', index=False)
+    assert (tmp_path / 'result.Loans.csv').read_text() == (tmp_path / 'pandas.csv').read_text()
@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from ltv_incremental import load_snapshot, run_lp_incremental, solve_component_problems_incremental
+from ltv_lp import allocation_table, build_component_problems, solve_component_problems
+from synthetic_tape import DEBT_COL, make_clean_portfolio
+
+GAV_COL = 'Gross Appraisal Value'
+CHANGES = 5
+
+
+def perturb(df_loans, df_collateral, changes, rng):
+    """Copies of the tape with `changes` each of its debts, asset values, liens and links altered."""
+    df_loans, df_collateral = df_loans.copy(), df_collateral.copy()
+
+    loans = rng.choice(len(df_loans), changes, replace=False)
+    df_loans.loc[df_loans.index[loans], DEBT_COL] *= 1.1
+
+    assets = rng.choice(df_collateral['Asset ID'].unique(), changes, replace=False)
+    df_collateral.loc[df_collateral['Asset ID'].isin(assets), GAV_COL] *= 0.9
+
+    loans = rng.choice(df_collateral['Loan reference'].unique(), changes, replace=False)
+    lien1 = df_collateral['Loan reference'].isin(loans) & (df_collateral['Priority Ranking'] == 'Lien 1')
+    df_collateral.loc[df_collateral['Loan reference'].isin(loans), 'Priority Ranking'] = 'Lien 1'
+    df_collateral.loc[lien1, 'Priority Ranking'] = 'Lien 2'
+
+    # Drop some links and pledge some existing assets to other loans
+    dropped = rng.choice(len(df_collateral), changes, replace=False)
+    added = df_collateral.iloc[rng.choice(len(df_collateral), changes, replace=False)].copy()
+    added['Loan reference'] = rng.choice(df_loans['Loan reference'].to_numpy(), changes)
+    df_collateral = pd.concat([df_collateral.drop(df_collateral.index[dropped]), added], ignore_index=True)
+    return df_loans, df_collateral.drop_duplicates(['Loan reference', 'Asset ID'], ignore_index=True)
+
+
+@pytest.fixture
+def tapes(tmp_path):
+    """Snapshot path solved for a synthetic tape, plus a perturbed copy of the tape."""
+    df_loans, df_collateral = make_clean_portfolio(600, cross_collateral_rate=0.4, seed=0)
+    snapshot_path = str(tmp_path / 'snapshot.pkl')
+    run_lp_incremental(df_loans, df_collateral, snapshot_path)
+    return snapshot_path, perturb(df_loans, df_collateral, CHANGES, np.random.default_rng(0))
+
+
+def _reused(results, snapshot):
+    previous = {id(result) for result in snapshot["results"]}
+    return sum(id(result) in previous for result in results)
+
+
+def test_incremental_matches_full_run(tapes):
+    snapshot_path, (df_loans, df_collateral) = tapes
+    snapshot = load_snapshot(snapshot_path)
+    problems = build_component_problems(df_loans, df_collateral)
+    results, _ = solve_component_problems_incremental(problems, snapshot)
+    assert 0 < _reused(results, snapshot) < len(problems)
+
+    full = solve_component_problems(build_component_problems(df_loans, df_collateral))
+    pd.testing.assert_frame_equal(allocation_table(results), allocation_table(full),
+                                  check_exact=False, rtol=1e-6, atol=1e-6)
+
+
+@pytest.mark.parametrize('settings', [{'backend': 'highs', 'fast_path': True},
+                                      {'backend': 'pulp', 'fast_path': False},
+                                      None])
+def test_settings_mismatch_resolves_everything(tapes, settings):
+    snapshot_path, (df_loans, df_collateral) = tapes
+    snapshot = load_snapshot(snapshot_path)
+    assert snapshot["settings"] == {"backend": "pulp", "fast_path": True}
+    if settings is None:  # snapshot written before settings were recorded
+        del snapshot["settings"]
+    else:
+        snapshot["settings"] = settings
+    problems = build_component_problems(df_loans, df_collateral)
+    results, new_snapshot = solve_component_problems_incremental(problems, snapshot)
+
+    assert _reused(results, snapshot) == 0
+    assert new_snapshot["settings"] == {"backend": "pulp", "fast_path": True}
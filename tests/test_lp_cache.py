@@ -0,0 +1,19 @@
+from ltv_lp import build_component_problems, solve_component_problems
+from synthetic_tape import make_clean_portfolio
+
+
+def test_cache_reports_its_own_hits_and_misses(tmp_path, capsys):
+    df_loans, df_collateral = make_clean_portfolio(400, cross_collateral_rate=0.4, seed=1)
+    problems = build_component_problems(df_loans, df_collateral)
+    cache_path = str(tmp_path / 'lp_cache.sqlite')
+
+    first = solve_component_problems(problems, cache_path=cache_path)
+    solved = sum(result["Solve Path"] == "LP solver" for result in first)
+    assert solved > 0
+    assert f"LP cache: 0 hits, {solved} misses" in capsys.readouterr().out
+
+    # Without the closed-form fast path every component goes through the cache
+    second = solve_component_problems(problems, cache_path=cache_path, fast_path=False, workers=2, batch_links=20)
+    hits = sum(result["Solve Path"] == "Cache" for result in second)
+    assert hits == solved
+    assert f"LP cache: {hits} hits, {len(problems) - hits} misses" in capsys.readouterr().out